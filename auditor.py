@@ -0,0 +1,273 @@
+import collections
+import concurrent.futures
+import os
+import time
+import typing
+
+import fastcopy
+import linker
+import timings
+from registry import STATE_DIRNAME
+from utils import file_hash
+
+GLOBAL = "global"
+PKG_DIRNAME = "pkg"
+
+# backups made by link are stale once older than this
+STALE_SECONDS = 30 * 24 * 60 * 60
+
+
+class File(typing.NamedTuple):
+    box: str
+    path: str
+    size: int
+    mtime: float
+    inode: tuple[int, int]
+
+
+def boxes(conf_dir: str) -> dict[str, str]:
+    # every "env/box" in the conf dir, plus the global dir
+    found = {}
+    global_dir = os.path.join(conf_dir, GLOBAL)
+    if os.path.isdir(global_dir):
+        found[GLOBAL] = global_dir
+    boxes_dir = os.path.join(conf_dir, "boxes")
+    if os.path.isdir(boxes_dir):
+        for env in sorted(os.listdir(boxes_dir)):
+            env_dir = os.path.join(boxes_dir, env)
+            if not os.path.isdir(env_dir):
+                continue
+            for box in sorted(os.listdir(env_dir)):
+                if os.path.isdir(os.path.join(env_dir, box)):
+                    found[f"{env}/{box}"] = os.path.join(env_dir, box)
+    return found
+
+
+def scan_box(name: str, box_dir: str) -> list[File]:
+    files = []
+    for path, _ in fastcopy.walk(box_dir, [STATE_DIRNAME]).files:
+        st = os.stat(os.path.join(box_dir, path))
+        files.append(File(name, path, st.st_size, st.st_mtime, (st.st_dev, st.st_ino)))
+    return files
+
+
+def is_manifest(path: str) -> bool:
+    # pkg manifests, without the dot-prefixed state sidecars next to them
+    dirname, basename = os.path.split(path)
+    return dirname == PKG_DIRNAME and not basename.startswith(".")
+
+
+def audit(
+    conf_dir: str, jobs: int = 1, top: int = 10, near_global: float = 0.8
+) -> dict:
+    found = boxes(conf_dir)
+    with concurrent.futures.ProcessPoolExecutor(max(jobs, 1)) as executor:
+        # walk every box, then hash each inode once, hardlinks included
+        with timings.phase("scan", boxes=len(found)) as details:
+            files = [
+                x
+                for box_files in executor.map(scan_box, found.keys(), found.values())
+                for x in box_files
+            ]
+            details["files"] = len(files)
+        paths: dict[tuple[int, int], str] = {}
+        for x in files:
+            paths.setdefault(x.inode, os.path.join(found[x.box], x.path))
+        with timings.phase("hash", files=len(paths)):
+            digests = dict(
+                zip(
+                    paths.keys(),
+                    executor.map(file_hash, paths.values(), chunksize=64),
+                    strict=True,
+                )
+            )
+
+    with timings.phase("index"):
+        box_names = [x for x in found if x != GLOBAL]
+        manifests = box_manifests(files, digests)
+        return {
+            "boxes": len(box_names),
+            "files": len(files),
+            "bytes": sum(x.size for x in files),
+            "duplicates": duplicates(files, digests, top),
+            "near_global": near_global_files(files, digests, box_names, near_global),
+            "missing_manifests": missing_manifests(manifests, box_names),
+            "diverged_manifests": diverged_manifests(manifests),
+            "stale_backups": stale_backups(files),
+            "largest_files": [
+                {"box": x.box, "path": x.path, "size": x.size}
+                for x in sorted(files, key=lambda x: -x.size)[:top]
+            ],
+            "largest_boxes": largest_boxes(files, top),
+        }
+
+
+def duplicates(
+    files: list[File], digests: dict[tuple[int, int], str], top: int
+) -> list[dict]:
+    # same content stored more than once, by bytes which could be saved
+    by_digest: dict[str, list[File]] = collections.defaultdict(list)
+    for x in files:
+        by_digest[digests[x.inode]].append(x)
+    found = []
+    for digest, copies in by_digest.items():
+        inodes = {x.inode for x in copies}
+        if len(inodes) > 1:
+            found.append((copies[0].size * (len(inodes) - 1), digest, len(inodes)))
+    found.sort(key=lambda x: (-x[0], x[1]))
+    return [
+        {
+            "sha256": digest,
+            "size": by_digest[digest][0].size,
+            "copies": copies,
+            "wasted": wasted,
+            "paths": sorted(f"{x.box}:{x.path}" for x in by_digest[digest]),
+        }
+        for wasted, digest, copies in found[:top]
+    ]
+
+
+def near_global_files(
+    files: list[File],
+    digests: dict[tuple[int, int], str],
+    box_names: list[str],
+    share: float,
+) -> list[dict]:
+    # paths with identical content in most boxes, candidates for global,
+    # leaving out pkg where manifests are per box by design
+    by_path: dict[str, collections.Counter] = collections.defaultdict(
+        collections.Counter
+    )
+    in_global = set()
+    for x in files:
+        if x.box == GLOBAL:
+            in_global.add((x.path, digests[x.inode]))
+        elif os.path.dirname(x.path) != PKG_DIRNAME:
+            by_path[x.path][digests[x.inode]] += 1
+    result = []
+    for path, counts in sorted(by_path.items()):
+        digest, count = counts.most_common(1)[0]
+        if box_names and count >= 2 and count / len(box_names) >= share:
+            result.append(
+                {
+                    "path": path,
+                    "boxes": count,
+                    "share": round(count / len(box_names), 3),
+                    "in_global": (path, digest) in in_global,
+                }
+            )
+    return result
+
+
+def box_manifests(
+    files: list[File], digests: dict[tuple[int, int], str]
+) -> dict[str, dict[str, str]]:
+    # pkg manifest digests of each box
+    manifests: dict[str, dict[str, str]] = collections.defaultdict(dict)
+    for x in files:
+        if x.box != GLOBAL and is_manifest(x.path):
+            manifests[x.box][x.path] = digests[x.inode]
+    return manifests
+
+
+def missing_manifests(
+    manifests: dict[str, dict[str, str]], box_names: list[str]
+) -> list[dict]:
+    # pkg manifests most boxes have but some boxes lack
+    boxes_with: dict[str, set[str]] = collections.defaultdict(set)
+    for box, paths in manifests.items():
+        for path in paths:
+            boxes_with[path].add(box)
+    common = [k for k, v in boxes_with.items() if len(v) * 2 > len(box_names)]
+    result = []
+    for box in box_names:
+        missing = sorted(x for x in common if box not in boxes_with[x])
+        if missing:
+            result.append({"box": box, "missing": missing})
+    return result
+
+
+def diverged_manifests(manifests: dict[str, dict[str, str]]) -> list[dict]:
+    # pkg manifests with more than one distinct content across boxes
+    variants: dict[str, collections.Counter] = collections.defaultdict(
+        collections.Counter
+    )
+    for paths in manifests.values():
+        for path, digest in paths.items():
+            variants[path][digest] += 1
+    return [
+        {
+            "path": path,
+            "variants": len(counts),
+            "boxes": sum(counts.values()),
+            "most_common": counts.most_common(1)[0][1],
+        }
+        for path, counts in sorted(variants.items())
+        if len(counts) > 1
+    ]
+
+
+def stale_backups(files: list[File]) -> list[dict]:
+    now = time.time()
+    return [
+        {"box": x.box, "path": x.path, "age_days": int((now - x.mtime) / 86400)}
+        for x in files
+        if linker.extension(x.path) == ".bk" and now - x.mtime > STALE_SECONDS
+    ]
+
+
+def largest_boxes(files: list[File], top: int) -> list[dict]:
+    sizes: dict[str, list[int]] = collections.defaultdict(lambda: [0, 0])
+    for x in files:
+        sizes[x.box][0] += 1
+        sizes[x.box][1] += x.size
+    ordered = sorted(sizes.items(), key=lambda x: -x[1][1])[:top]
+    return [{"box": k, "files": v[0], "size": v[1]} for k, v in ordered]
+
+
+def describe(report: dict) -> typing.Iterator[tuple[str, list[str], list[list]]]:
+    # titled tables of the report for text output
+    yield (
+        "duplicated content",
+        ["copies", "wasted", "size", "paths"],
+        [
+            [x["copies"], x["wasted"], x["size"], " ".join(x["paths"])]
+            for x in report["duplicates"]
+        ],
+    )
+    yield (
+        "near global files",
+        ["path", "boxes", "share", "in global"],
+        [
+            [x["path"], x["boxes"], x["share"], x["in_global"]]
+            for x in report["near_global"]
+        ],
+    )
+    yield (
+        "missing manifests",
+        ["box", "missing"],
+        [[x["box"], " ".join(x["missing"])] for x in report["missing_manifests"]],
+    )
+    yield (
+        "diverged manifests",
+        ["path", "variants", "boxes", "most common"],
+        [
+            [x["path"], x["variants"], x["boxes"], x["most_common"]]
+            for x in report["diverged_manifests"]
+        ],
+    )
+    yield (
+        "stale backups",
+        ["box", "path", "age days"],
+        [[x["box"], x["path"], x["age_days"]] for x in report["stale_backups"]],
+    )
+    yield (
+        "largest files",
+        ["box", "path", "size"],
+        [[x["box"], x["path"], x["size"]] for x in report["largest_files"]],
+    )
+    yield (
+        "largest boxes",
+        ["box", "files", "size"],
+        [[x["box"], x["files"], x["size"]] for x in report["largest_boxes"]],
+    )
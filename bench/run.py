@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+CLI_PATH = os.path.join(ROOT_DIR, "cli.py")
+
+sys.path.insert(0, ROOT_DIR)
+from utils import print_table  # noqa: E402
+
+ENV = "bench"
+BOX = "bench"
+SIZES = [10, 1000, 50000]
+
+# stand in for every package manager, behaviour picked by the name it runs as
+STUB = """#!{python}
+import json, os, sys, time
+
+time.sleep(float(os.getenv("FS_STUB_LATENCY_MS", "0")) / 1000)
+size = int(os.getenv("FS_STUB_BYTES", "0"))
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+repo = ""
+if name == "git" and args[:1] == ["-C"]:
+    repo, args = args[1], args[2:]
+if name == "git" and args[:1] == ["clone"]:
+    git_dir = os.path.join(args[-1], ".git")
+    os.makedirs(os.path.join(git_dir, "objects"))
+    with open(os.path.join(git_dir, "HEAD"), "w") as f:
+        f.write("ref: refs/heads/main\\n")
+    with open(os.path.join(git_dir, "config"), "w") as f:
+        f.write(f'[remote "origin"]\\n\\turl = {{args[-2]}}\\n')
+elif name == "git" and args == ["remote"]:
+    print("origin")
+elif name == "git" and args[:2] == ["remote", "get-url"]:
+    print(f"https://example.com/{{os.path.basename(repo)}}.git")
+elif name == "git" and args[:1] == ["remote"]:
+    pass
+elif name == "npm" and args[:1] == ["list"]:
+    count = max(size // 40, 1)
+    deps = {{f"pkg{{i}}": {{"version": "1.0.0"}} for i in range(count)}}
+    print(json.dumps({{"name": "lib", "dependencies": deps}}))
+elif name == "pipx" and args[:1] == ["list"]:
+    print(json.dumps({{"venvs": {{}}, "padding": "x" * size}}))
+elif name == "brew" and "--file" in args:
+    with open(args[args.index("--file") + 1], "w") as f:
+        f.write("brew \\"pkg\\"\\n" * max(size // 11, 1))
+elif name == "dconf" and args[:1] == ["dump"]:
+    print("[org/bench]")
+    for i in range(max(size // 12, 1)):
+        print(f"key{{i}}=true")
+elif name == "crontab" and args[:1] == ["-l"]:
+    print("* * * * * true\\n" * max(size // 15, 1), end="")
+elif args[:1] == ["--version"] or name == "which":
+    print(f"{{name}} 0.0.0")
+"""
+STUB_NAMES = ["brew", "crontab", "dconf", "git", "npm", "pipx", "which"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="time every cli.py command against synthetic conf trees"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=SIZES, help="entries per tree"
+    )
+    parser.add_argument("-n", type=int, default=3, help="runs per measurement")
+    parser.add_argument(
+        "--latency-ms", type=float, default=50, help="stub package manager latency"
+    )
+    parser.add_argument(
+        "--output-kb", type=int, default=64, help="stub package manager output size"
+    )
+    parser.add_argument("-o", "--output", help="write json results to this file")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for size in args.sizes:
+        results += bench_size(size, args)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.n,
+        "latency_ms": args.latency_ms,
+        "output_kb": args.output_kb,
+        "results": results,
+    }
+    for result in results:
+        print(
+            f"{result['size']:>6} {result['command']:<28} "
+            f"{result['phase']:<8} {result['seconds'] * 1000:10.1f}ms"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(f"{json.dumps(report, indent=4)}\n")
+
+
+def bench_size(size: int, args: argparse.Namespace) -> list[dict]:
+    results = []
+
+    def record(command: str, runs: list[dict[str, float]]) -> None:
+        # median of each phase over the runs which reported it
+        for phase in runs[0]:
+            results.append(
+                {
+                    "size": size,
+                    "command": command,
+                    "phase": phase,
+                    "seconds": statistics.median(x[phase] for x in runs if phase in x),
+                }
+            )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_dir = os.path.join(tmp_dir, "bin")
+        make_stubs(bin_dir)
+        env = dict(
+            os.environ,
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            FS_STUB_LATENCY_MS=str(args.latency_ms),
+            FS_STUB_BYTES=str(args.output_kb * 1024),
+        )
+
+        def run(command: list[str], build: bool = True) -> dict[str, float]:
+            if build:
+                build_tree(tmp_dir, size)
+            env["HOME"] = os.path.join(tmp_dir, "home")
+            return run_cli(tmp_dir, command, env)
+
+        # every command end to end, and per phase from its trace
+        for name, command in [
+            ("link --dry-run", ["link", "-g", "-b", "--dry-run"]),
+            ("link", ["link", "-g", "-b", "-f"]),
+            ("status", ["status"]),
+            ("clean", ["clean", "-f", "--depth", "0"]),
+        ]:
+            record(name, [run(command) for _ in range(args.n)])
+        build_tree(tmp_dir, size)
+        run(["link", "-g", "-f"], build=False)
+        record("status (linked)", [run(["status"], False) for _ in range(args.n)])
+
+        store_runs = []
+        for _ in range(args.n):
+            build_tree(tmp_dir, size)
+            target = os.path.join(tmp_dir, "home", "stored")
+            make_files(target, size)
+            store_runs.append(run(["store", "-f", target], build=False))
+        record("store", store_runs)
+
+        clone_runs = []
+        for i in range(args.n):
+            build_tree(tmp_dir, size)
+            clone = ["--box", f"clone{i}", "init", "--clone", ENV, BOX]
+            clone_runs.append(run(clone, build=False))
+        record("init --clone", clone_runs)
+
+        for packager in ["brew", "crontab", "dconf", "git", "npm", "pipx"]:
+            for action in ["verify", "backup"]:
+                command = ["package", packager, action]
+                record(" ".join(command), [run(command, False) for _ in range(args.n)])
+
+        # backups of a fresh set of repos, then restores cloning all of them
+        projects_dir = os.path.join(tmp_dir, "home", "projects")
+        backup_runs = []
+        for _ in range(args.n):
+            make_repos(projects_dir, max(size // 500, 2))
+            backup_runs.append(run(["package", "git", "backup"], False))
+        record("package git backup (changed)", backup_runs)
+        restore_runs = []
+        for _ in range(args.n):
+            shutil.rmtree(projects_dir, ignore_errors=True)
+            restore_runs.append(run(["package", "git", "restore", "-j", "8"], False))
+        record("package git restore", restore_runs)
+    return results
+
+
+def build_tree(tmp_dir: str, size: int) -> tuple[str, list[str]]:
+    # half global, half box, with home holding files, stale links and dirs
+    home_dir = os.path.join(tmp_dir, "home")
+    conf_dir = os.path.join(tmp_dir, "conf")
+    global_dir = os.path.join(conf_dir, "global")
+    box_dir = os.path.join(conf_dir, "boxes", ENV, BOX)
+    for path in [home_dir, conf_dir]:
+        shutil.rmtree(path, ignore_errors=True)
+    for path in [home_dir, global_dir, os.path.join(box_dir, "pkg")]:
+        os.makedirs(path)
+    for i in range(size):
+        name = f".entry{i}"
+        conf_path = os.path.join(global_dir if i % 2 else box_dir, name)
+        home_path = os.path.join(home_dir, name)
+        if i % 10 == 0:
+            os.makedirs(conf_path)
+        else:
+            write(conf_path, name)
+        if i % 4 == 1:
+            write(home_path, name)
+        elif i % 8 == 2:
+            os.symlink(os.path.join(tmp_dir, "missing", name), home_path)
+        elif i % 8 == 6:
+            os.makedirs(home_path)
+    return home_dir, [global_dir, box_dir]
+
+
+def make_files(directory: str, count: int) -> None:
+    os.makedirs(directory)
+    for i in range(count):
+        write(os.path.join(directory, f"file{i}"), "x" * 128)
+
+
+def make_repos(directory: str, count: int) -> None:
+    # enough of a repo for remotes to be read from its config
+    shutil.rmtree(directory, ignore_errors=True)
+    for i in range(count):
+        git_dir = os.path.join(directory, f"repo{i}", ".git")
+        os.makedirs(os.path.join(git_dir, "objects"))
+        write(os.path.join(git_dir, "HEAD"), "ref: refs/heads/main\n")
+        config = f'[remote "origin"]\n\turl = https://example.com/repo{i}.git\n'
+        write(os.path.join(git_dir, "config"), config)
+
+
+def make_stubs(bin_dir: str) -> None:
+    os.makedirs(bin_dir)
+    stub_path = os.path.join(bin_dir, "stub")
+    write(stub_path, STUB.format(python=sys.executable))
+    os.chmod(stub_path, 0o755)
+    for name in STUB_NAMES:
+        os.symlink(stub_path, os.path.join(bin_dir, name))
+
+
+def run_cli(tmp_dir: str, command: list[str], env: dict) -> dict[str, float]:
+    conf_dir = os.path.join(tmp_dir, "conf")
+    trace_path = os.path.join(tmp_dir, "trace.jsonl")
+    base = [sys.executable, CLI_PATH, "--conf", conf_dir, "--env", ENV]
+    base += ["--trace-json", trace_path]
+    if "--box" not in command:
+        base += ["--box", BOX]
+    start = time.perf_counter()
+    subprocess.run(
+        base + command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    phases = {"total": time.perf_counter() - start}
+
+    # phases which repeat, like scanning each conf dir, are summed
+    with open(trace_path, "r") as f:
+        for line in f:
+            span = json.loads(line)
+            if span["category"] == "phase":
+                phases[span["name"]] = phases.get(span["name"], 0) + span["wall"]
+    return phases
+
+
+def write(path: str, data: str) -> None:
+    with open(path, "w") as f:
+        f.write(data)
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "-C", ROOT_DIR, "rev-parse", "HEAD"],
+        capture_output=True,
+        encoding="utf-8",
+    )
+    return result.stdout.strip()
+
+
+def compare(old_path: str, new_path: str) -> None:
+    def load(path: str) -> dict[tuple, float]:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return {
+            (x["size"], x["command"], x["phase"]): x["seconds"] for x in data["results"]
+        }
+
+    old = load(old_path)
+    new = load(new_path)
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        times = [f"{old[key] * 1000:.1f}", f"{new[key] * 1000:.1f}"]
+        rows.append([str(x) for x in key] + times + [f"{change:+.1f}%"])
+    print_table(["size", "command", "phase", "old ms", "new ms", "change"], rows)
+
+
+if __name__ == "__main__":
+    main()
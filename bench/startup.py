@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+CLI_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "cli.py")
+
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+import packagers  # noqa: E402
+
+# commands which must start without loading any packager
+COMMANDS = {
+    "link": ["link", "--dry-run"],
+    "clean": ["clean", "--depth", "1", "-f"],
+    "status": ["status"],
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="measure cli.py startup with python -X importtime"
+    )
+    parser.add_argument("-n", type=int, default=10, help="runs per command")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    parser.add_argument(
+        "--budget-ms", type=float, default=0, help="fail if import time is above this"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        home_dir = os.path.join(tmp_dir, "home")
+        conf_dir = os.path.join(tmp_dir, "conf")
+        os.makedirs(home_dir)
+        os.makedirs(os.path.join(conf_dir, "global"))
+        os.makedirs(os.path.join(conf_dir, "boxes", "bench", "bench"))
+        env = dict(os.environ, HOME=home_dir)
+        results = {
+            name: measure(command, conf_dir, env, args.n)
+            for name, command in COMMANDS.items()
+        }
+
+    forbidden = packager_modules()
+    failed = False
+    for result in results.values():
+        result["packagers"] = sorted(set(result["modules"]) & forbidden)
+        result["top"] = sorted(result["modules"].items(), key=lambda x: -x[1])[
+            : args.top
+        ]
+        failed |= bool(result["packagers"])
+        failed |= bool(args.budget_ms and result["import_ms"] > args.budget_ms)
+        del result["modules"]
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for name, result in results.items():
+            print(
+                f"{name}: wall {result['wall_ms']:.1f}ms, "
+                f"imports {result['import_ms']:.1f}ms"
+            )
+            for module, us in result["top"]:
+                print(f"    {us / 1000:8.1f}ms  {module}")
+            if result["packagers"]:
+                print(f"    packagers imported: {result['packagers']}")
+    exit(1 if failed else 0)
+
+
+def measure(command: list[str], conf_dir: str, env: dict, runs: int) -> dict:
+    base = [sys.executable, CLI_PATH, "--conf", conf_dir, "--env", "bench"]
+    base += ["--box", "bench"]
+    walls = []
+    modules: dict[str, int] = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(base + command, env=env, capture_output=True, check=True)
+        walls.append((time.perf_counter() - start) * 1000)
+
+    # one extra run for the per module import breakdown
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + base[1:] + command,
+        env=env,
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [x.strip() for x in line[len("import time:") :].split("|")]
+        if not fields[0].isdigit():
+            continue
+        module = fields[2].strip()
+        modules[module] = int(fields[1])
+        total += int(fields[0])
+    return {
+        "wall_ms": statistics.median(walls),
+        "import_ms": total / 1000,
+        "modules": modules,
+    }
+
+
+def packager_modules() -> set[str]:
+    names = {x.partition(":")[0] for x in packagers.REGISTRY.values()}
+    return names | {"apt", "packagers.abstract"}
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
 #!/usr/bin/python3
 
 import argparse
-import inspect
+import collections
+import concurrent.futures
+import json
 import logging
 import os
-import shutil
+import subprocess
 import sys
+import time
+import typing
 
+import clone
+import linker
 import packagers
+import packagers.exceptions
+import registry
+import scanner
+import timings
 import utils
 
+# auditor, fastcopy, snapshots and watcher are imported by the commands using
+# them, keeping them off the startup path of every other command
+if typing.TYPE_CHECKING:
+    import snapshots
+    from packagers.abstract import AbstractPackager
+
 HOME_DIR = os.path.expanduser("~")
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -20,15 +36,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# map package cli choice to classname
-PACKAGE_OPTION_MAP = {
-    x[0].lower(): x[0]
-    for x in inspect.getmembers(packagers, inspect.isclass)
-    if not x[0].startswith("Abstract")
-}
+# package cli choice which runs every packager
+PACKAGE_ALL = "all"
+
+# package actions which can read an older snapshot
+AT_ACTIONS = ["diff", "info", "restore"]
+
+# commands run across every box, needing no env or box
+FLEET_COMMANDS = ["audit", "gc"]
 
 
 def main() -> None:
+    start = time.perf_counter()
+    cpu = time.process_time()
+
     # set defaults based on env vars
     default_conf_varname = "FS_CONF"
     default_conf_dir = os.getenv(default_conf_varname, os.path.join(SCRIPT_DIR, "conf"))
@@ -58,6 +79,16 @@ def main() -> None:
         default=default_box,
         help=f'override default box dir: "{default_box}"',
     )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="print wall and cpu time of each phase and subprocess to stderr",
+    )
+    parser.add_argument(
+        "--trace-json",
+        metavar="FILE",
+        help='write timings as chrome trace json, or json lines for ".jsonl"',
+    )
 
     subparser = parser.add_subparsers(dest="command")
 
@@ -72,6 +103,19 @@ def main() -> None:
     link_subparser.add_argument(
         "-b", action="store_true", help="create backup if file already exists"
     )
+    link_subparser.add_argument(
+        "--dry-run", action="store_true", help="print planned actions and exit"
+    )
+    link_subparser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="undo an interrupted run instead of finishing it",
+    )
+    link_subparser.add_argument(
+        "--full",
+        action="store_true",
+        help="rescan every dir instead of only those changed since the last run",
+    )
     link_subparser.set_defaults(func=link)
 
     # sub-parser for init process
@@ -81,6 +125,23 @@ def main() -> None:
     init_subparser.add_argument(
         "--clone", nargs=2, help='two values, "env box" to clone files from'
     )
+    init_subparser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="only copy cloned files when they are first modified",
+    )
+    init_subparser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help="hardlink cloned files which cannot be reflinked instead of copying",
+    )
+    init_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel copy workers",
+    )
     init_subparser.set_defaults(func=init)
 
     # sub-parser for store process
@@ -96,6 +157,13 @@ def main() -> None:
     store_subparser.add_argument(
         "-g", action="store_true", help="store in global conf dir"
     )
+    store_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel copy workers",
+    )
     store_subparser.set_defaults(func=store)
 
     # sub-parser for package process
@@ -104,23 +172,75 @@ def main() -> None:
     )
     package_subparser.add_argument(
         "cmd",
-        choices=PACKAGE_OPTION_MAP.keys(),
+        choices=list(packagers.REGISTRY.keys()) + [PACKAGE_ALL],
         type=str.lower,
         help="package management category",
     )
     package_subparser.add_argument(
         "action",
-        choices=[
-            x
-            for x in dir(packagers.AbstractPackager)
-            if callable(getattr(packagers.AbstractPackager, x))
-            and not x.startswith("_")
-        ],
+        choices=packagers.ACTIONS,
         type=str.lower,
         help="operation to perform",
     )
+    package_subparser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of parallel workers"
+    )
+    package_subparser.add_argument(
+        "--at",
+        metavar="SNAPSHOT",
+        help=f"read the backup as of a snapshot, for {', '.join(AT_ACTIONS)}",
+    )
+    package_subparser.add_argument(
+        "--json", action="store_true", help="print diff results as json lines"
+    )
+    package_subparser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run verify commands instead of trusting cached results",
+    )
+    package_subparser.add_argument(
+        "--depth", type=int, default=0, help="shallow clone depth for git restore"
+    )
+    package_subparser.add_argument(
+        "--filter",
+        dest="clone_filter",
+        default="",
+        help='partial clone filter for git restore (ex. "blob:none")',
+    )
+    package_subparser.add_argument(
+        "--subtree",
+        dest="subtrees",
+        action="append",
+        help="dconf dir to back up or restore, repeatable, defaults to all",
+    )
     package_subparser.set_defaults(func=package)
 
+    # sub-parser for history process
+    history_subparser = subparser.add_parser(
+        "history", help="list snapshots made by package backups"
+    )
+    history_subparser.set_defaults(func=history)
+
+    # sub-parser for status process
+    status_subparser = subparser.add_parser(
+        "status", help="check links created by link and store"
+    )
+    status_subparser.set_defaults(func=status)
+
+    # sub-parser for unlink process
+    unlink_subparser = subparser.add_parser(
+        "unlink", help="remove links created by link and store"
+    )
+    unlink_subparser.add_argument(
+        "targets",
+        nargs="*",
+        help="links to remove, defaults to managed links in home dir",
+    )
+    unlink_subparser.add_argument(
+        "-f", action="store_true", help="do not prompt on remove"
+    )
+    unlink_subparser.set_defaults(func=unlink)
+
     # sub-parser for clean process
     clean_subparser = subparser.add_parser(
         "clean", help="remove broken symlinks in home dir"
@@ -128,13 +248,98 @@ def main() -> None:
     clean_subparser.add_argument(
         "-f", action="store_true", help="do not prompt on remove"
     )
+    clean_subparser.add_argument(
+        "--depth", type=int, default=3, help="max dir depth to search, 0 for no limit"
+    )
+    clean_subparser.add_argument(
+        "-e",
+        "--exclude",
+        action="append",
+        help=f"glob of names to skip, added to {scanner.DEFAULT_EXCLUDES}",
+    )
+    clean_subparser.add_argument(
+        "-x", action="store_true", help="stay on the home dir filesystem"
+    )
+    clean_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel workers",
+    )
+    clean_subparser.add_argument(
+        "--only-managed",
+        action="store_true",
+        help="only remove links pointing into conf dir",
+    )
     clean_subparser.set_defaults(func=clean)
 
+    # sub-parser for watch process
+    watch_subparser = subparser.add_parser(
+        "watch", help="keep home dir links in sync as conf dirs change"
+    )
+    watch_subparser.add_argument(
+        "-g", action="store_true", help="apply global settings"
+    )
+    watch_subparser.add_argument(
+        "-f",
+        action="store_true",
+        help="remove or move existing files, otherwise they are skipped",
+    )
+    watch_subparser.add_argument(
+        "-b", action="store_true", help="create backup if file already exists"
+    )
+    watch_subparser.add_argument(
+        "--debounce",
+        type=float,
+        default=1.0,
+        help="seconds without changes before relinking",
+    )
+    watch_subparser.set_defaults(func=watch)
+
+    # sub-parser for audit process
+    audit_subparser = subparser.add_parser(
+        "audit", help="report drift across every box in the conf dir"
+    )
+    audit_subparser.add_argument(
+        "--json", action="store_true", help="print the report as json"
+    )
+    audit_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes",
+    )
+    audit_subparser.add_argument(
+        "--top", type=int, default=10, help="entries in duplicate and size reports"
+    )
+    audit_subparser.add_argument(
+        "--near-global",
+        type=float,
+        default=0.8,
+        help="share of boxes with identical content to suggest it be global",
+    )
+    audit_subparser.set_defaults(func=audit)
+
+    # sub-parser for gc process
+    gc_subparser = subparser.add_parser(
+        "gc", help="remove objects which no box's snapshots point at"
+    )
+    gc_subparser.add_argument(
+        "--min-age",
+        type=float,
+        default=24,
+        help="hours unreferenced objects are kept, a backup may not have synced",
+    )
+    gc_subparser.set_defaults(func=gc)
+
     # read in args
     args = parser.parse_args()
 
-    # additional custom args validation
-    if not args.env:
+    # additional custom args validation, fleet commands span every box
+    fleet = args.command in FLEET_COMMANDS
+    if not args.env and not fleet:
         print(
             f'env not set in --env or "${default_env_varname}", please set it now: ',
             end="",
@@ -142,7 +347,7 @@ def main() -> None:
         args.env = input().lower()
         if not args.env:
             fatal("Invalid input!")
-    if not args.box:
+    if not args.box and not fleet:
         print(
             f'box not set in --box or "${default_box_varname}", please set it now: ',
             end="",
@@ -152,20 +357,30 @@ def main() -> None:
             fatal("Invalid input!")
 
     # format args into dirs
-    args.box_conf = box_dirname(args.conf, args.env, args.box)
+    args.box_conf = "" if fleet else box_dirname(args.conf, args.env, args.box)
     args.global_conf = os.path.join(args.conf, "global")
 
     # verify conf directory exists
     if not os.path.isdir(args.conf):
         fatal(f'"{args.conf}" does not exist!')
-    if not os.path.isdir(args.box_conf) and args.command != "init":
+    if not fleet and not os.path.isdir(args.box_conf) and args.command != "init":
         fatal(f'"{args.box_conf}" does not exist! Use "init" command to create it.')
 
     # run the actual process
     if "func" not in args:
         parser.print_help()
         exit(1)
-    args.func(args)
+    timings.enabled = bool(args.timings or args.trace_json)
+    wall = time.perf_counter() - start
+    timings.record("parse args", timings.PHASE, start, wall, time.process_time() - cpu)
+    try:
+        with timings.phase(args.command):
+            args.func(args)
+    finally:
+        if args.timings:
+            utils.print_table(timings.HEADERS, timings.rows(), file=sys.stderr)
+        if args.trace_json:
+            timings.write_trace(args.trace_json)
 
 
 def box_dirname(conf_dirname: str, env: str, box: str) -> str:
@@ -189,9 +404,9 @@ def init(args: argparse.Namespace) -> None:
     # create global conf dir if not exists
     if not os.path.isdir(global_target):
         os.makedirs(global_target)
-        logger.debug(f"created {global_target}")
+        logger.debug("created %s", global_target)
     else:
-        logger.debug(f"exists {global_target}")
+        logger.debug("exists %s", global_target)
 
     if args.clone:
         # copy existing dir into new one
@@ -200,18 +415,24 @@ def init(args: argparse.Namespace) -> None:
             fatal(f'"{clone_source}" does not exist!')
         if os.path.exists(box_target):
             fatal(f'Cannot clone into existing location at "{box_target}"!')
-        shutil.copytree(clone_source, box_target)
-        logger.debug(f"Cloned into {box_target}")
+        methods = clone.clone(
+            args.conf, clone_source, box_target, args.lazy, args.hardlink, args.jobs
+        )
+        counts = collections.Counter(methods.values())
+        summary = ", ".join(f"{v} {k}" for k, v in sorted(counts.items()))
+        print(f"cloned {clone_source} into {box_target}: {summary or 'lazy'}")
     else:
         # create box conf dir if not exists
         if not os.path.isdir(box_target):
             os.makedirs(box_target)
-            logger.debug(f"created {box_target}")
+            logger.debug("created %s", box_target)
         else:
-            logger.debug(f"exists {box_target}")
+            logger.debug("exists %s", box_target)
 
 
 def store(args: argparse.Namespace) -> None:
+    import fastcopy
+
     target = os.path.normpath(args.target)
 
     # handle global dir flag
@@ -220,34 +441,66 @@ def store(args: argparse.Namespace) -> None:
         destination_dir = args.global_conf
 
     # validate source can be moved
-    if not target.startswith(HOME_DIR):
+    relative = linker.relative(target, [HOME_DIR])
+    if not relative:
         fatal(f'"{target}" must be in "{HOME_DIR}"!')
     if os.path.islink(target):
         fatal(f'"{target}" cannot be a symlink!')
     if not os.path.exists(target):
         fatal(f'"{target}" does not exist!')
+    stored = os.lstat(target)
 
-    # check overwrite on destination
-    destination = os.path.join(destination_dir, os.path.basename(target))
+    # check overwrite on destination, at the same path link would use
+    destination = os.path.join(destination_dir, relative)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
     if os.path.exists(destination):
         if not args.f and not utils.query_yes_no(f'overwrite at "{destination}"?'):
             exit(1)
 
-    # move and symlink to homr dir
-    shutil.move(target, destination)
-    os.symlink(destination, os.path.join(HOME_DIR, os.path.basename(target)))
+    # copy and verify across filesystems before anything in home is touched
+    staging_dir = os.path.join(destination_dir, registry.STATE_DIRNAME, "tmp")
+    try:
+        copied = fastcopy.move(target, destination, staging_dir, args.jobs)
+    except (OSError, fastcopy.CopyException) as e:
+        fatal(f'Failed to store "{target}": {e}')
+
+    # symlink where the source was, swapping out the copied source
+    with registry.lock(args.box_conf), timings.phase("link"):
+        if copied and not (
+            os.path.lexists(target) and os.path.samestat(stored, os.lstat(target))
+        ):
+            fatal(f'"{target}" changed while storing, its copy is "{destination}"')
+        if copied:
+            fastcopy.swap_symlink(destination, target)
+        else:
+            os.symlink(destination, target)
+        link_registry = registry.Registry(args.box_conf)
+        link_registry.add(target, destination)
+        link_registry.compact()
 
 
 def package(args: argparse.Namespace) -> None:
-    packager_classname = PACKAGE_OPTION_MAP[args.cmd]
+    import snapshots
+
     package_dir = os.path.join(args.box_conf, "pkg")
     if not os.path.isdir(package_dir):
         os.makedirs(package_dir)
-    packager = getattr(packagers, packager_classname)(package_dir)
+    if args.at:
+        if args.action not in AT_ACTIONS:
+            fatal(f"--at only applies to {AT_ACTIONS}")
+        try:
+            box_snapshots(args).find(args.at)
+        except snapshots.SnapshotException as e:
+            fatal(str(e))
+    if args.cmd == PACKAGE_ALL:
+        package_all(args, package_dir)
+        return
+    try:
+        packager = make_packager(args.cmd, package_dir, args)
+    except snapshots.SnapshotException as e:
+        fatal(str(e))
     try:
-        packager.verify()
-        if args.action != "verify":
-            getattr(packager, args.action)()
+        run_packager(packager, args.action)
     except NotImplementedError:
         fatal(f'Action "{args.action}" not available for "{args.cmd}"!')
     except packagers.exceptions.SudoException:
@@ -258,85 +511,393 @@ sudo {os.path.abspath(sys.argv[0])} --env {args.env} --box {args.box} {args.comm
         """)  # noqa: E501
         exit(13)
     except Exception as e:
-        logger.debug(str(type(e)))
+        logger.debug("%s", type(e))
         fatal(str(e))
 
 
+def package_all(args: argparse.Namespace, package_dir: str) -> None:
+    # restores run in dependency order, everything else at once
+    names = list(packagers.REGISTRY.keys())
+    levels = [names]
+    if args.action == "restore":
+        levels = restore_levels(names)
+
+    results: dict[str, tuple[str, str, float, str]] = {}
+    for level in levels:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(level)) as executor:
+            futures = {
+                executor.submit(run_timed, x, package_dir, args): x for x in level
+            }
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+
+    # keep stdout to json lines when asked for
+    output = sys.stderr if args.json else sys.stdout
+    print("", file=output)
+    utils.print_table(
+        ["packager", "result", "seconds", "detail"],
+        [
+            (name, result, f"{seconds:.2f}", detail)
+            for name, result, seconds, detail in (results[x] for x in names)
+        ],
+        file=output,
+    )
+    if any(x[1] == "failed" for x in results.values()):
+        exit(1)
+
+
+def restore_levels(names: list[str]) -> list[list[str]]:
+    levels = []
+    done: set[str] = set()
+    remaining = list(names)
+    while remaining:
+        level = [
+            x
+            for x in remaining
+            if all(y in done or y not in names for y in packagers.load(x).restore_after)
+        ]
+        if not level:
+            fatal(f"circular restore order between {remaining}")
+        levels.append(level)
+        done.update(level)
+        remaining = [x for x in remaining if x not in level]
+    return levels
+
+
+def run_timed(
+    name: str, package_dir: str, args: argparse.Namespace
+) -> tuple[str, str, float, str]:
+    import snapshots
+
+    start = time.monotonic()
+    try:
+        packager = make_packager(name, package_dir, args)
+    except snapshots.SnapshotException as e:
+        return name, "unavailable", time.monotonic() - start, str(e)
+    try:
+        with timings.phase(f"{name} verify"):
+            packager.verify()
+    except (subprocess.CalledProcessError, OSError) as e:
+        return name, "unavailable", time.monotonic() - start, str(e)
+    try:
+        run_packager(packager, args.action, verify=False)
+    except NotImplementedError:
+        return name, "unavailable", time.monotonic() - start, "not implemented"
+    except packagers.exceptions.SudoException:
+        return name, "failed", time.monotonic() - start, "access denied"
+    except Exception as e:
+        return name, "failed", time.monotonic() - start, str(e) or str(type(e))
+    return name, "ok", time.monotonic() - start, ""
+
+
+def make_packager(
+    name: str, package_dir: str, args: argparse.Namespace
+) -> "AbstractPackager":
+    packager_class = packagers.load(name)
+    options = {x: getattr(args, x) for x in packager_class.options}
+    packager = packager_class(package_dir, **options)
+
+    # lazy clones read backups from their source box until the first backup
+    relative = os.path.relpath(packager.filepath, args.box_conf)
+    packager.readpath = clone.Clone(args.box_conf, args.conf).resolve(relative)
+    packager.snapshots = box_snapshots(args)
+    if args.at:
+        packager.readpath = packager.snapshots.checkout(args.at, packager.filepath)
+    packager.use_cache = not args.no_cache
+    packager.verbose = not args.json
+    packager.json_output = args.json
+    return packager
+
+
+def box_snapshots(args: argparse.Namespace) -> "snapshots.Snapshots":
+    import snapshots
+
+    return snapshots.Snapshots(args.box_conf, snapshots.ObjectStore(args.conf))
+
+
+def history(args: argparse.Namespace) -> None:
+    rows = []
+    previous: dict[str, str] = {}
+    for snapshot in box_snapshots(args).load():
+        changed = [k for k, v in snapshot.files.items() if previous.get(k) != v]
+        rows.append((snapshot.id, snapshot.time, " ".join(sorted(changed))))
+        previous = snapshot.files
+    if not rows:
+        print("no snapshots, run a package backup first")
+        return
+    utils.print_table(["snapshot", "time", "changed"], rows)
+
+
+def run_packager(
+    packager: "AbstractPackager", action: str, verify: bool = True
+) -> None:
+    name = type(packager).__name__.lower()
+    if verify:
+        with timings.phase(f"{name} verify"):
+            packager.verify()
+    if action != "verify":
+        with timings.phase(f"{name} {action}"):
+            getattr(packager, action)()
+
+
 def clean(args: argparse.Namespace) -> None:
-    for item in os.listdir(HOME_DIR):
-        full_path = os.path.join(HOME_DIR, item)
-        if os.path.islink(full_path) and not os.path.exists(os.readlink(full_path)):
-            if args.f or utils.query_yes_no(f'unlink at "{full_path}"?'):
-                os.unlink(full_path)
-                logger.debug(f"removed {full_path}")
+    excludes = scanner.DEFAULT_EXCLUDES + (args.exclude or [])
+    with timings.phase("scan") as details:
+        broken = scanner.find_broken_links(
+            HOME_DIR, args.depth, excludes, args.x, args.jobs
+        )
+        if args.only_managed:
+            broken = [x for x in broken if scanner.points_into(x, args.conf)]
+        details["broken"] = len(broken)
+    if not broken:
+        print("no broken links found")
+        return
+
+    # report everything found, then confirm once
+    print("")
+    for path in broken:
+        print(f"{path} -> {os.readlink(path)}")
+    print("")
+    if args.f or utils.query_yes_no(f"unlink {len(broken)} broken links?"):
+        with timings.phase("unlink"):
+            for path in broken:
+                os.unlink(path)
+                logger.debug("removed %s", path)
+
+
+def status(args: argparse.Namespace) -> None:
+    links = registry.Registry(args.box_conf).load()
+    if not links:
+        print("no managed links")
+        return
+    utils.print_table(
+        ["target", "source", "status"],
+        [(x.target, x.source, registry.status(x)) for x in links.values()],
+    )
 
 
-def link(args: argparse.Namespace) -> None:
-    # build list of files to symlink from
-    files: list[tuple] = []
+def unlink(args: argparse.Namespace) -> None:
+    # only touch links which are still managed and still ours, by default
+    # those in this home dir
+    links = registry.Registry(args.box_conf).load()
+    targets = [os.path.abspath(x) for x in args.targets] or [
+        x for x in links if linker.relative(x, [HOME_DIR])
+    ]
+    unknown = [x for x in targets if x not in links]
+    if unknown:
+        fatal(f"not managed links: {unknown}")
+    print("")
+    for target in targets:
+        print(f"{target} -> {links[target].source}")
+    print("")
+    if not args.f and not utils.query_yes_no(f"unlink {len(targets)} links?"):
+        exit(1)
 
-    # optionally add global files
-    if args.g:
-        add_files(args.global_conf, files)
+    with registry.lock(args.box_conf):
+        # another run may have changed links while confirming
+        link_registry = registry.Registry(args.box_conf)
+        for target in targets:
+            link = link_registry.load().get(target)
+            if link and link.source == links[target].source:
+                linker.unlink(link, link_registry)
+        link_registry.compact()
 
-    # add files specific to box in args
-    add_files(args.box_conf, files)
 
-    # remove files and create symlinks
-    for file_tuple in files:
+def link(args: argparse.Namespace) -> None:
+    box = clone.Clone(args.box_conf, args.conf)
+    conf_dirs = link_dirs(args, box)
+    link_registry = registry.Registry(args.box_conf)
+    journal = registry.Journal(args.box_conf)
+    if args.rollback:
+        with registry.lock(args.box_conf):
+            count = linker.rollback(journal, link_registry)
+        print(f"rolled back {count} actions of an interrupted run")
+        return
+
+    # plan and confirm all removes/moves at once without the lock, so a
+    # prompt left open doesn't hold up watch or other runs
+    planned: typing.Optional[tuple[linker.Action, ...]] = None
+    index: typing.Optional[linker.Index] = None
+    confirmed: set[str] = set()
+    if args.dry_run or not args.f:
+        planned, index = plan_links(args, conf_dirs)
+        print_plan(planned, index)
+        if args.dry_run:
+            return
+        destructive = linker.destructive(planned)
+        if destructive and utils.query_yes_no(
+            f"remove or move {len(destructive)} files?"
+        ):
+            confirmed = {x.target for x in destructive}
+
+    with registry.lock(args.box_conf):
+        # home or the conf dirs may have changed while confirming, the plan
+        # is only made again if so and only confirmed targets are removed or
+        # moved
+        recover(link_registry, journal)
+        actions = planned
+        if actions is None or index is None or index.stale():
+            actions, index = plan_links(args, conf_dirs)
+            if actions != planned:
+                if planned is not None:
+                    print("the plan changed while confirming, now:")
+                print_plan(actions, index)
+        if not args.f:
+            actions = linker.decline(actions, confirmed)
+
+        with timings.phase("apply"):
+            apply_links(args, box, actions, link_registry, journal)
+        link_registry.compact()
+        index.save(actions)
         print("")
 
-        directory = file_tuple[0]
-        filename = file_tuple[1]
-
-        # symlink source and target
-        source = os.path.join(directory, filename)
-        target = os.path.join(HOME_DIR, filename)
-
-        # remove file(s) existing in home dir
-        if os.path.isdir(target) and not os.path.islink(target):
-            logger.warning('skipping dir "%s"' % target)
-            continue
-        elif os.path.islink(target) and os.readlink(target) == source:
-            logger.warning('skipping already linked "%s"' % target)
-            continue
-        elif os.path.isfile(target) or os.path.islink(target):
-            if args.f or utils.query_yes_no('remove file at "%s"?' % target):
-                # backup if file is not symlink and option is on
-                if args.b and not os.path.islink(target):
-                    os.rename(target, "%s.bk" % target)
-                    logger.debug('moved "%s"' % target)
-                else:
-                    os.remove(target)
-                    logger.debug('removed "%s"' % target)
-
-            else:
-                logger.warning('not linking "%s"' % target)
-                continue
-        else:
-            logger.debug('nothing at "%s"' % target)
 
-        # create the symlink
-        os.symlink(source, target)
-        logger.debug('created "%s" -> "%s"' % (source, target))
+def plan_links(
+    args: argparse.Namespace, conf_dirs: list[str]
+) -> tuple[tuple[linker.Action, ...], linker.Index]:
+    # the full plan up front, only listing dirs changed since the last run
+    # unless --full
+    index = linker.Index(args.box_conf, conf_dirs, HOME_DIR)
+    if not args.full:
+        index.load()
+    with timings.phase("plan") as details:
+        actions = linker.plan(conf_dirs, HOME_DIR, args.b, index=index)
+        details["actions"] = len(actions)
+    return actions, index
+
 
+def print_plan(actions: tuple[linker.Action, ...], index: linker.Index) -> None:
+    if not actions and index.previous["levels"]:
+        print("nothing changed since the last link, --full rescans every dir")
+    print("")
+    print(os.linesep.join(linker.describe(actions)))
     print("")
 
 
-def add_files(directory: str, files: list[tuple]) -> None:
-    if not os.path.isdir(directory):
-        fatal('"%s" is not a dir' % directory)
-    ignore_extensions = [".swp", ".swo", ".bk"]
-    files += [
-        (directory, x)
-        for x in os.listdir(directory)
-        if extension(x) not in ignore_extensions
-    ]
+def recover(link_registry: registry.Registry, journal: registry.Journal) -> None:
+    if journal.load():
+        count = linker.recover(journal, link_registry)
+        logger.warning("finishing %d actions of an interrupted run", count)
+
+
+def watch(args: argparse.Namespace) -> None:
+    import watcher
+
+    box = clone.Clone(args.box_conf, args.conf)
+    conf_dirs = link_dirs(args, box)
+
+    # events name paths in any conf or home dir, plans take them relative to
+    # the innermost one since a conf dir may well be inside home
+    bases = sorted(conf_dirs + [HOME_DIR], key=len, reverse=True)
+
+    def relink(paths: typing.Optional[set[str]]) -> None:
+        # a conf dir mid remount would look like every file was removed
+        missing = [x for x in conf_dirs if not os.path.isdir(x)]
+        if missing:
+            logger.warning("waiting for %s", missing)
+            return
+        names = None
+        if paths is not None:
+            names = {linker.relative(x, bases) for x in paths} - {""}
+        visited: set[str] = set()
+        link_registry = registry.Registry(args.box_conf)
+        journal = registry.Journal(args.box_conf)
+        with registry.lock(args.box_conf), timings.phase("relink") as details:
+            recover(link_registry, journal)
+            actions = linker.plan(conf_dirs, HOME_DIR, args.b, names, visited=visited)
+            if names is not None:
+                actions = tuple(x for x in actions if x.reason != linker.ALREADY_LINKED)
+            if not args.f:
+                actions = linker.decline(actions)
+            details["actions"] = len(actions)
+            for line in linker.describe(actions):
+                print(line)
+            try:
+                apply_links(args, box, actions, link_registry, journal)
+
+                # only explicit events remove links, never a full recheck
+                for link in list(link_registry.load().values()):
+                    source = linker.relative(link.source, conf_dirs)
+                    if (
+                        names
+                        and source
+                        and linker.matches(source, names)
+                        and registry.status(link) == registry.BROKEN
+                    ):
+                        print(f"unlink   {link.target} -> {link.source}")
+                        linker.unlink(link, link_registry)
+                link_registry.compact()
+            except OSError as e:
+                logger.error("%s", e)
+
+        # every dir the plan looked into, which a full recheck replaces
+        dir_watcher.watch(visited, replace=paths is None)
+
+    print(f"watching {', '.join(conf_dirs)} and {HOME_DIR}")
+    dir_watcher = watcher.Watcher(conf_dirs + [HOME_DIR], relink, args.debounce)
+    try:
+        dir_watcher.run()
+    except KeyboardInterrupt:
+        print("")
+
+
+def link_dirs(args: argparse.Namespace, box: clone.Clone) -> list[str]:
+    # optionally add global files, box files take precedence over any lazy
+    # clone sources which take precedence over global files
+    conf_dirs = [*reversed(box.sources()), args.box_conf]
+    if args.g:
+        conf_dirs.insert(0, args.global_conf)
+    for directory in conf_dirs:
+        if not os.path.isdir(directory):
+            fatal(f'"{directory}" is not a dir')
+    return conf_dirs
+
+
+def apply_links(
+    args: argparse.Namespace,
+    box: clone.Clone,
+    actions: tuple[linker.Action, ...],
+    link_registry: registry.Registry,
+    journal: registry.Journal,
+) -> None:
+    # files edited through a link need a private copy in a cloned box
+    if box.sources() or box.shared():
+        box_dirs = [args.box_conf, *box.sources()]
+        with timings.phase("materialize"):
+            materialized = []
+            for action in actions:
+                relative = ""
+                if action.kind in linker.LINKING:
+                    relative = linker.relative(action.source, box_dirs)
+                if relative:
+                    action = action._replace(source=box.materialize(relative))
+                materialized.append(action)
+            actions = tuple(materialized)
+    linker.apply(actions, link_registry, journal)
+
+
+def audit(args: argparse.Namespace) -> None:
+    import auditor
+
+    report = auditor.audit(args.conf, args.jobs, args.top, args.near_global)
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    print(f"{report['boxes']} boxes, {report['files']} files, {report['bytes']} bytes")
+    for title, headers, rows in auditor.describe(report):
+        print("")
+        print(f"{title}:")
+        if rows:
+            utils.print_table(headers, rows)
+        else:
+            print("none")
+
 
+def gc(args: argparse.Namespace) -> None:
+    import snapshots
 
-def extension(file_path: str) -> str:
-    _, extension = os.path.splitext(file_path)
-    return extension
+    removed = snapshots.collect(args.conf, args.min_age * 60 * 60)
+    print(f"removed {removed} unreferenced objects")
 
 
 def fatal(message: str, code: int = 1) -> None:
@@ -0,0 +1,130 @@
+import json
+import os
+import typing
+
+from registry import STATE_DIRNAME
+from utils import write_atomic
+
+CLONE_FILENAME = "clone.json"
+
+# box conf dirs under the conf dir, sources are recorded relative to it as
+# "env/box" so clones keep working wherever the conf dir is checked out
+BOXES_DIRNAME = "boxes"
+
+
+class Clone(object):
+    # where a cloned box came from, for files it doesn't hold a copy of yet
+    path = ""
+
+    def __init__(self, box_conf: str, conf_dir: str) -> None:
+        self.box_conf = box_conf
+        self.boxes_dir = os.path.join(conf_dir, BOXES_DIRNAME)
+        self.path = os.path.join(box_conf, STATE_DIRNAME, CLONE_FILENAME)
+        self.data: typing.Optional[dict] = None
+
+    def load(self) -> dict:
+        if self.data is None:
+            try:
+                with open(self.path, "r") as f:
+                    self.data = json.load(f)
+            except FileNotFoundError:
+                self.data = {}
+        return self.data
+
+    def save(self) -> None:
+        data = self.load()
+        if data.get("sources") or data.get("shared"):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, f"{json.dumps(data, indent=4, sort_keys=True)}\n")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def sources(self) -> list[str]:
+        # box conf dirs of a lazy clone, nearest first
+        return [os.path.join(self.boxes_dir, x) for x in self.load().get("sources", [])]
+
+    def shared(self) -> list[str]:
+        # relative paths hardlinked with the box this was cloned from
+        return self.load().get("shared", [])
+
+    def resolve(self, relative: str) -> str:
+        # the box's own copy if there is one, otherwise the nearest source's
+        path = os.path.join(self.box_conf, relative)
+        if os.path.lexists(path):
+            return path
+        for source in self.sources():
+            if os.path.lexists(os.path.join(source, relative)):
+                return os.path.join(source, relative)
+        return path
+
+    def materialize(self, relative: str, jobs: int = 1) -> str:
+        # give the box a private copy of relative before it can be modified
+        path = os.path.join(self.box_conf, relative)
+        resolved = self.resolve(relative)
+        shared = self.shared()
+        prefix = os.path.join(relative, "")
+        broken = [x for x in shared if x == relative or x.startswith(prefix)]
+        if resolved == path and not broken:
+            return path
+
+        # only boxes which are clones need fastcopy, keep it off link startup
+        import fastcopy
+
+        if resolved != path:
+            fastcopy.copy_tree(resolved, path, jobs, verify=False)
+        for x in broken:
+            fastcopy.unshare(os.path.join(self.box_conf, x))
+        if broken:
+            self.load()["shared"] = [x for x in shared if x not in broken]
+            self.save()
+        return path
+
+
+def clone(
+    conf_dir: str,
+    source: str,
+    destination: str,
+    lazy: bool,
+    hardlink: bool,
+    jobs: int = 1,
+) -> dict[str, str]:
+    # new box from source, returns the copy method used for each file
+    import fastcopy
+    import snapshots
+
+    methods = {}
+    if lazy:
+        os.makedirs(destination)
+    else:
+        methods = fastcopy.copy_tree(
+            source,
+            destination,
+            jobs,
+            verify=False,
+            hardlink=hardlink,
+            exclude=[STATE_DIRNAME],
+            label="cloned",
+        )
+
+    # a clone of a lazy box still falls back to that box's sources
+    sources = Clone(source, conf_dir).sources()
+    if lazy:
+        sources = [source] + sources
+    result = Clone(destination, conf_dir)
+    result.load().update(
+        {
+            "sources": [os.path.relpath(x, result.boxes_dir) for x in sources],
+            "shared": sorted(k for k, v in methods.items() if v == fastcopy.HARDLINK),
+        }
+    )
+    result.save()
+
+    # backups live in the object store, the source's snapshots point at them
+    snapshots_path = os.path.join(source, STATE_DIRNAME, snapshots.SNAPSHOTS_FILENAME)
+    if not lazy and os.path.isfile(snapshots_path):
+        state_dir = os.path.join(destination, STATE_DIRNAME)
+        os.makedirs(state_dir, exist_ok=True)
+        fastcopy.copy_file(
+            snapshots_path, os.path.join(state_dir, snapshots.SNAPSHOTS_FILENAME)
+        )
+    return methods
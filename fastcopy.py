@@ -0,0 +1,265 @@
+import concurrent.futures
+import contextlib
+import errno
+import fcntl
+import os
+import shutil
+import sys
+import threading
+import time
+import typing
+
+import timings
+from utils import file_hash
+
+# linux ioctl sharing extents between files, supported by btrfs and xfs
+FICLONE = 0x40049409
+
+# seconds between progress lines
+PROGRESS_INTERVAL = 0.5
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY_FILE_RANGE = "copy_file_range"
+COPY = "copy"
+
+
+class CopyException(Exception):
+    pass
+
+
+class Tree(typing.NamedTuple):
+    # paths relative to the tree root, parents before children
+    dirs: list[str]
+    files: list[tuple[str, int]]
+    links: list[str]
+
+
+def walk(root: str, exclude: typing.Optional[list[str]] = None) -> Tree:
+    # exclude only applies to names at the top of the tree
+    tree = Tree([], [], [])
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(root, relative)) as it:
+            for entry in it:
+                if not relative and entry.name in (exclude or []):
+                    continue
+                path = os.path.join(relative, entry.name)
+                if entry.is_symlink():
+                    tree.links.append(path)
+                elif entry.is_dir():
+                    tree.dirs.append(path)
+                    stack.append(path)
+                else:
+                    tree.files.append((path, entry.stat().st_size))
+    return tree
+
+
+def copy_file(source: str, destination: str, hardlink: bool = False) -> str:
+    # cheapest available copy of one file, returns the method which worked
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            method = REFLINK
+        except OSError:
+            method = ""
+    if not method and hardlink:
+        os.remove(destination)
+        try:
+            os.link(source, destination)
+            return HARDLINK
+        except OSError:
+            pass
+    if not method:
+        method = _copy_data(source, destination)
+    shutil.copystat(source, destination)
+    return method
+
+
+def _copy_data(source: str, destination: str) -> str:
+    # copy_file_range stays in the kernel, older kernels refuse across mounts
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            size = os.fstat(src.fileno()).st_size
+            offset = 0
+            while offset < size:
+                copied = os.copy_file_range(
+                    src.fileno(), dst.fileno(), size - offset, offset, offset
+                )
+                if not copied:
+                    break
+                offset += copied
+            return COPY_FILE_RANGE
+        except OSError as e:
+            if e.errno not in [errno.EXDEV, errno.EINVAL, errno.ENOSYS]:
+                raise e
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst, 1 << 20)
+            return COPY
+
+
+def unshare(path: str) -> None:
+    # replace a hardlinked file with a private copy, so writes stay local
+    if os.path.isdir(path) and not os.path.islink(path):
+        for relative, _ in walk(path).files:
+            unshare(os.path.join(path, relative))
+        return
+    if os.path.islink(path) or os.stat(path).st_nlink < 2:
+        return
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        copy_file(path, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+
+class Progress(object):
+    def __init__(self, label: str, total_files: int, total_bytes: int) -> None:
+        self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.printed = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, size: int) -> None:
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            now = time.monotonic()
+            if now - self.printed >= PROGRESS_INTERVAL:
+                self.printed = now
+                self._print("\r" if sys.stderr.isatty() else "\n")
+
+    def done(self) -> None:
+        self._print("\r" if sys.stderr.isatty() else "\n")
+        sys.stderr.write("\n")
+
+    def _print(self, prefix: str) -> None:
+        sys.stderr.write(
+            f"{prefix}{self.label} {self.files}/{self.total_files} files, "
+            f"{self.bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB"
+        )
+        sys.stderr.flush()
+
+
+def copy_tree(
+    source: str,
+    destination: str,
+    jobs: int = 1,
+    verify: bool = True,
+    hardlink: bool = False,
+    exclude: typing.Optional[list[str]] = None,
+    label: str = "copied",
+) -> dict[str, str]:
+    # copy a file or dir tree in parallel, returns the method used per file
+    if not os.path.isdir(source) or os.path.islink(source):
+        return {"": _copy_one(source, destination, verify, hardlink)}
+
+    with timings.phase("walk", path=source) as details:
+        tree = walk(source, exclude)
+        details["files"] = len(tree.files)
+    os.makedirs(destination)
+    for path in tree.dirs:
+        os.mkdir(os.path.join(destination, path))
+    for path in tree.links:
+        os.symlink(
+            os.readlink(os.path.join(source, path)), os.path.join(destination, path)
+        )
+
+    methods = {}
+    progress = Progress(label, len(tree.files), sum(x[1] for x in tree.files))
+    with timings.phase("copy", files=len(tree.files), jobs=jobs):
+        with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as executor:
+            futures = {
+                executor.submit(
+                    _copy_one,
+                    os.path.join(source, path),
+                    os.path.join(destination, path),
+                    verify,
+                    hardlink,
+                ): (path, size)
+                for path, size in tree.files
+            }
+            for future in concurrent.futures.as_completed(futures):
+                path, size = futures[future]
+                methods[path] = future.result()
+                progress.update(size)
+        progress.done()
+
+    # children first, so creating them doesn't bump the parent mtime again
+    for path in reversed(tree.dirs):
+        shutil.copystat(os.path.join(source, path), os.path.join(destination, path))
+    shutil.copystat(source, destination)
+    return methods
+
+
+def move(source: str, destination: str, staging_dir: str, jobs: int = 1) -> bool:
+    # rename on the same filesystem, otherwise copy into staging_dir first,
+    # returns true when the source still needs removing
+    parent = os.path.dirname(destination)
+    if os.stat(source).st_dev == os.stat(parent).st_dev:
+        install(source, destination, staging_dir)
+        return False
+    os.makedirs(staging_dir, exist_ok=True)
+    staged = os.path.join(staging_dir, f"{os.path.basename(destination)}.{os.getpid()}")
+    try:
+        copy_tree(source, staged, jobs)
+        install(staged, destination, staging_dir)
+    except BaseException as e:
+        remove(staged)
+        raise e
+    finally:
+        with contextlib.suppress(OSError):
+            os.rmdir(staging_dir)
+    return True
+
+
+def install(path: str, destination: str, staging_dir: str) -> None:
+    # rename into place, moving anything already there aside first
+    if not os.path.lexists(destination):
+        os.rename(path, destination)
+        return
+    os.makedirs(staging_dir, exist_ok=True)
+    old = os.path.join(
+        staging_dir, f"{os.path.basename(destination)}.{os.getpid()}.old"
+    )
+    os.rename(destination, old)
+    os.rename(path, destination)
+    remove(old)
+
+
+def swap_symlink(link_target: str, path: str) -> None:
+    # replace whatever is at path with a symlink, never leaving it missing
+    link = f"{path}.{os.getpid()}.link"
+    os.symlink(link_target, link)
+    if os.path.isdir(path) and not os.path.islink(path):
+        old = f"{path}.{os.getpid()}.old"
+        os.rename(path, old)
+        os.replace(link, path)
+        remove(old)
+    else:
+        os.replace(link, path)
+
+
+def remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _copy_one(source: str, destination: str, verify: bool, hardlink: bool) -> str:
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), destination)
+        return COPY
+    method = copy_file(source, destination, hardlink)
+    if verify and method != HARDLINK and file_hash(source) != file_hash(destination):
+        raise CopyException(f'copy of "{source}" does not match')
+    return method
@@ -0,0 +1,80 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import typing
+
+# event masks from linux/inotify.h
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# changes to the entries of a dir, and to the dir itself going away
+DIR_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB
+SELF_CHANGES = IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT
+GONE = SELF_CHANGES | IN_IGNORED
+
+EVENT = struct.Struct("iIII")
+
+
+class Event(typing.NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify(object):
+    def __init__(self) -> None:
+        name = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(name, use_errno=True)
+        self.fd = self._check(self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+
+    def add(self, path: str, mask: int) -> int:
+        return self._check(
+            self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        )
+
+    def remove(self, wd: int) -> None:
+        # the kernel drops watches itself on unmount or delete
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: typing.Optional[float] = None) -> list[Event]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def _check(self, result: int) -> int:
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return result
@@ -0,0 +1,522 @@
+import json
+import logging
+import os
+import shutil
+import typing
+
+import timings
+from registry import (
+    BROKEN,
+    MISSING,
+    OK,
+    STATE_DIRNAME,
+    Journal,
+    Link,
+    Registry,
+    status,
+)
+from utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+IGNORE_EXTENSIONS = [".swp", ".swo", ".bk"]
+IGNORE_NAMES = [STATE_DIRNAME]
+
+# plan action kinds
+SKIP = "skip"
+REPLACE = "replace"
+BACKUP = "backup"
+CREATE = "create"
+MKDIR = "mkdir"
+UNFOLD = "unfold"
+DESTRUCTIVE = [REPLACE, BACKUP]
+LINKING = [REPLACE, BACKUP, CREATE]
+
+ALREADY_LINKED = "already linked"
+NOT_CONFIRMED = "not confirmed"
+
+INDEX_FILENAME = "index.json"
+
+
+class Action(typing.NamedTuple):
+    kind: str
+    source: str
+    target: str
+    reason: str = ""
+
+
+class ConfEntry(typing.NamedTuple):
+    name: str
+    path: str
+    is_dir: bool
+
+
+class Index(object):
+    # conf dir listings and home dir mtimes as of the last completed link of
+    # each home dir, an unchanged conf dir is not listed again and an
+    # unchanged level of both holds nothing new to link so is skipped
+    path = ""
+
+    def __init__(self, box_conf: str, conf_dirs: list[str], home_dir: str) -> None:
+        self.path = os.path.join(box_conf, STATE_DIRNAME, INDEX_FILENAME)
+        self.conf_dirs = conf_dirs
+        self.home_dir = home_dir
+        self.previous: dict[str, dict] = {"levels": {}, "listings": {}}
+        self.levels: dict[str, dict] = {}
+        self.listings: dict[str, dict] = {}
+        self.mtimes: dict[str, typing.Optional[int]] = {}
+
+    def load(self) -> None:
+        entry = self._read().get(self.home_dir, {})
+        if entry.get("conf_dirs") == self.conf_dirs:
+            self.previous = entry
+
+    def mtime(self, path: str) -> typing.Optional[int]:
+        # one stat per conf dir and run
+        if path not in self.mtimes:
+            self.mtimes[path] = mtime(path)
+        return self.mtimes[path]
+
+    def listing(self, directory: str) -> typing.Optional[dict[str, ConfEntry]]:
+        cached = self.previous["listings"].get(directory)
+        if not cached or cached["mtime"] != self.mtime(directory):
+            return None
+        self.listings[directory] = cached
+        return {
+            k: ConfEntry(k, os.path.join(directory, k), v)
+            for k, v in cached["entries"].items()
+        }
+
+    def record_listing(
+        self, directory: str, modified: typing.Optional[int], entries: dict
+    ) -> None:
+        self.listings[directory] = {
+            "mtime": modified,
+            "entries": {k: v.is_dir for k, v in entries.items()},
+        }
+
+    def unchanged(self, home_dir: str, conf_paths: list[str]) -> bool:
+        record = self.previous["levels"].get(home_dir)
+        if not record or record["conf"] != conf_paths or record["home"] is None:
+            return False
+        if mtime(home_dir) != record["home"]:
+            return False
+        if any(self.listing(x) is None for x in conf_paths):
+            return False
+        self.levels[home_dir] = record
+        return True
+
+    def merged(self, home_dir: str) -> dict[str, list[str]]:
+        return self.previous["levels"][home_dir]["merged"]
+
+    def stale(self) -> bool:
+        # whether a dir the plan looked into changed since, stat'ed as it was
+        # planned so a change made while planning is seen too
+        stamps = {**self.mtimes, **{k: v["home"] for k, v in self.levels.items()}}
+        return any(mtime(k) != v for k, v in stamps.items())
+
+    def save(self, actions: typing.Iterable[Action]) -> None:
+        # dirs with declined actions are scanned again, and those which were
+        # changed are stat'ed again now the links are in place
+        declined = set()
+        applied = set()
+        for action in actions:
+            if action.reason == NOT_CONFIRMED:
+                declined.add(os.path.dirname(action.target))
+            elif action.kind != SKIP:
+                applied.add(os.path.dirname(action.target))
+        levels = {}
+        for home_dir, record in self.levels.items():
+            if home_dir in declined:
+                continue
+            if record["home"] is None or home_dir in applied:
+                record = {**record, "home": mtime(home_dir)}
+            levels[home_dir] = record
+        data = self._read()
+        data[self.home_dir] = {
+            "conf_dirs": self.conf_dirs,
+            "levels": levels,
+            "listings": self.listings,
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps(data))
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def scan(directory: str) -> dict[str, os.DirEntry]:
+    with os.scandir(directory) as it:
+        return {x.name: x for x in it}
+
+
+def scan_conf(directory: str, index: typing.Optional[Index]) -> dict[str, ConfEntry]:
+    # from the index while the dir's mtime is unchanged
+    if index is None:
+        modified = None
+    else:
+        cached = index.listing(directory)
+        if cached is not None:
+            return cached
+        # stat before listing so a change in between is seen by the next run
+        modified = index.mtime(directory)
+    with timings.phase("scan conf", path=directory):
+        entries = {
+            k: ConfEntry(k, v.path, v.is_dir(follow_symlinks=False))
+            for k, v in scan(directory).items()
+        }
+    if index is not None:
+        index.record_listing(directory, modified, entries)
+    return entries
+
+
+def mtime(path: str) -> typing.Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def extension(file_path: str) -> str:
+    _, extension = os.path.splitext(file_path)
+    return extension
+
+
+def plan(
+    conf_dirs: list[str],
+    home_dir: str,
+    backup: bool,
+    names: typing.Optional[typing.Collection[str]] = None,
+    index: typing.Optional[Index] = None,
+    visited: typing.Optional[set[str]] = None,
+) -> tuple[Action, ...]:
+    # later conf dirs take precedence over earlier ones, names limits the plan
+    # to paths relative to the conf and home dirs, visited collects every conf
+    # and home dir the plan looks into
+    actions: list[Action] = []
+    if names is not None:
+        index = None
+    _plan_dir(conf_dirs, home_dir, True, backup, actions, index, names, "", visited)
+    return tuple(actions)
+
+
+def matches(path: str, names: typing.Collection[str]) -> bool:
+    # relative path is one of names, inside one or holds one
+    return any(
+        x == path or x.startswith(f"{path}/") or path.startswith(f"{x}/") for x in names
+    )
+
+
+def _plan_dir(
+    conf_paths: list[str],
+    home_dir: str,
+    home_exists: bool,
+    backup: bool,
+    actions: list[Action],
+    index: typing.Optional[Index],
+    names: typing.Optional[typing.Collection[str]] = None,
+    prefix: str = "",
+    visited: typing.Optional[set[str]] = None,
+) -> None:
+    # stow style, a conf dir is linked whole unless home or another conf dir
+    # has something at the same path, then its entries are linked one by one
+    if visited is not None:
+        visited.update(conf_paths)
+        visited.add(home_dir)
+    if index and home_exists and index.unchanged(home_dir, conf_paths):
+        for name, sub_paths in index.merged(home_dir).items():
+            sub_dir = os.path.join(home_dir, name)
+            _plan_dir(sub_paths, sub_dir, True, backup, actions, index, visited=visited)
+        return
+
+    merged: dict[str, list[ConfEntry]] = {}
+    for directory in conf_paths:
+        for name, entry in scan_conf(directory, index).items():
+            if name in IGNORE_NAMES:
+                continue
+            if names is not None and not matches(os.path.join(prefix, name), names):
+                continue
+            if extension(name) not in IGNORE_EXTENSIONS:
+                merged.setdefault(name, []).append(entry)
+
+    # decide on each target using the cached home dir entries
+    home_mtime = None
+    home_entries: dict[str, os.DirEntry] = {}
+    if home_exists:
+        home_mtime = mtime(home_dir)
+        with timings.phase("scan home", path=home_dir):
+            home_entries = scan(home_dir)
+    descended: dict[str, list[str]] = {}
+    for name, candidates in merged.items():
+        target = os.path.join(home_dir, name)
+        home_entry = home_entries.get(name)
+
+        # a file shadows anything before it, dirs after it merge together
+        dirs: list[ConfEntry] = []
+        for entry in reversed(candidates):
+            if not entry.is_dir:
+                break
+            dirs.insert(0, entry)
+        if not dirs:
+            actions.append(_plan_link(candidates[-1].path, target, home_entry, backup))
+            continue
+
+        if home_entry and not home_entry.is_symlink() and home_entry.is_dir():
+            sub_exists = True
+        elif len(dirs) == 1:
+            actions.append(_plan_link(dirs[0].path, target, home_entry, backup))
+            continue
+        elif home_entry is None:
+            actions.append(Action(MKDIR, "", target))
+            sub_exists = False
+        elif home_entry.is_symlink() and os.readlink(target) in [
+            x.path for x in candidates
+        ]:
+            # a dir linked whole earlier now needs entries from another
+            actions.append(Action(UNFOLD, os.readlink(target), target, "merging dirs"))
+            sub_exists = False
+        else:
+            actions.append(Action(SKIP, "", target, "not a dir"))
+            continue
+        descended[name] = [x.path for x in dirs]
+        _plan_dir(
+            descended[name],
+            target,
+            sub_exists,
+            backup,
+            actions,
+            index,
+            names,
+            os.path.join(prefix, name),
+            visited,
+        )
+
+    if index is not None:
+        index.levels[home_dir] = {
+            "conf": conf_paths,
+            "home": home_mtime,
+            "merged": descended,
+        }
+
+
+def _plan_link(
+    source: str, target: str, home_entry: typing.Optional[os.DirEntry], backup: bool
+) -> Action:
+    if home_entry is None:
+        return Action(CREATE, source, target)
+    if home_entry.is_symlink():
+        if os.readlink(target) == source:
+            return Action(SKIP, source, target, ALREADY_LINKED)
+        return Action(REPLACE, source, target, "symlink")
+    if home_entry.is_dir():
+        return Action(SKIP, source, target, "dir")
+    if home_entry.is_file():
+        if backup:
+            return Action(BACKUP, source, target, "file")
+        return Action(REPLACE, source, target, "file")
+    return Action(SKIP, source, target, "unsupported file type")
+
+
+def relative(path: str, directories: typing.Iterable[str]) -> str:
+    # path relative to whichever of directories holds it, empty if none does
+    for directory in directories:
+        if path.startswith(os.path.join(directory, "")):
+            return os.path.relpath(path, directory)
+    return ""
+
+
+def destructive(actions: typing.Iterable[Action]) -> list[Action]:
+    return [x for x in actions if x.kind in DESTRUCTIVE]
+
+
+def decline(
+    actions: typing.Iterable[Action], confirmed: typing.Collection[str] = ()
+) -> tuple[Action, ...]:
+    # keep non-destructive actions, and destructive ones on confirmed targets
+    return tuple(
+        x._replace(kind=SKIP, reason=NOT_CONFIRMED)
+        if x.kind in DESTRUCTIVE and x.target not in confirmed
+        else x
+        for x in actions
+    )
+
+
+def describe(actions: typing.Iterable[Action]) -> list[str]:
+    lines = []
+    for action in actions:
+        line = f"{action.kind:<8} {action.target}"
+        if action.source:
+            line += f" -> {action.source}"
+        if action.reason:
+            line += f" ({action.reason})"
+        lines.append(line)
+    return lines
+
+
+def apply(
+    actions: typing.Iterable[Action],
+    registry: typing.Optional[Registry] = None,
+    journal: typing.Optional[Journal] = None,
+) -> None:
+    actions = tuple(actions)
+    entries = {x.target: _entry(x) for x in actions}
+    if journal:
+        journal.begin([entries[x.target] for x in actions if x.kind != SKIP])
+    for action in actions:
+        target = action.target
+        backup = ""
+        if action.kind == SKIP:
+            logger.warning('skipping %s "%s"', action.reason, target)
+            if registry and action.reason == ALREADY_LINKED:
+                registry.adopt(target, action.source)
+            continue
+        if action.kind in [MKDIR, UNFOLD]:
+            if action.kind == UNFOLD:
+                os.remove(target)
+                if registry:
+                    registry.remove(target)
+            os.mkdir(target)
+            logger.debug('created dir "%s"', target)
+            continue
+        if action.kind == BACKUP:
+            backup = entries[target]["backup"]
+            _keep(target, backup)
+            logger.debug('backed up "%s"', target)
+        elif action.kind == REPLACE:
+            logger.debug('replacing "%s"', target)
+        else:
+            logger.debug('nothing at "%s"', target)
+
+        # swap the symlink in, target is never missing along the way
+        temp = temp_path(target)
+        if os.path.lexists(temp):
+            os.remove(temp)
+        os.symlink(action.source, temp)
+        os.replace(temp, target)
+        logger.debug('created "%s" -> "%s"', action.source, target)
+        if registry:
+            registry.add(target, action.source, backup)
+    if journal:
+        journal.finish()
+
+
+def recover(journal: Journal, registry: Registry) -> int:
+    # record links an interrupted run made, the rest get planned again
+    entries = journal.load()
+    for entry in entries:
+        target = entry["target"]
+        _remove_temp(entry)
+        if entry["kind"] in LINKING and _points_to(target, entry["source"]):
+            backup = entry["backup"] if os.path.lexists(entry["backup"]) else ""
+            registry.add(target, entry["source"], backup)
+        elif entry["kind"] in LINKING:
+            _drop_backup(entry)
+        elif entry["kind"] == UNFOLD and not os.path.islink(target):
+            registry.remove(target)
+    journal.finish()
+    return len(entries)
+
+
+def rollback(journal: Journal, registry: Registry) -> int:
+    # undo whatever an interrupted run got done, newest first
+    entries = journal.load()
+    for entry in reversed(entries):
+        target = entry["target"]
+        _remove_temp(entry)
+        if entry["kind"] in LINKING:
+            if not _points_to(target, entry["source"]):
+                _drop_backup(entry)
+                continue
+            if entry["backup"] and os.path.lexists(entry["backup"]):
+                os.replace(entry["backup"], target)
+                logger.debug('restored "%s"', entry["backup"])
+            elif entry["kind"] == REPLACE:
+                logger.warning('keeping link, "%s" was already replaced', target)
+                registry.add(target, entry["source"])
+                continue
+            else:
+                os.remove(target)
+                logger.debug('removed "%s"', target)
+            registry.remove(target)
+        elif os.path.isdir(target) and not os.path.islink(target):
+            try:
+                os.rmdir(target)
+            except OSError:
+                logger.warning('not removing dir "%s", it is not empty', target)
+                continue
+            logger.debug('removed dir "%s"', target)
+            if entry["kind"] == UNFOLD:
+                os.symlink(entry["source"], target)
+                registry.add(target, entry["source"])
+    journal.finish()
+    return len(entries)
+
+
+def backup_path(target: str) -> str:
+    # a .bk left from an earlier link may be all that remains of a file
+    backup = f"{target}.bk"
+    count = 0
+    while os.path.lexists(backup):
+        count += 1
+        backup = f"{target}.{count}.bk"
+    return backup
+
+
+def temp_path(target: str) -> str:
+    return f"{target}.{os.getpid()}.link"
+
+
+def _entry(action: Action) -> dict:
+    backup = backup_path(action.target) if action.kind == BACKUP else ""
+    return {**action._asdict(), "backup": backup, "temp": temp_path(action.target)}
+
+
+def _keep(target: str, backup: str) -> None:
+    # hardlink the file aside so it stays in place until it is replaced,
+    # never over an existing backup
+    if os.path.lexists(backup):
+        raise FileExistsError(f'backup "{backup}" already exists')
+    try:
+        os.link(target, backup, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copy2(target, backup, follow_symlinks=False)
+
+
+def _points_to(target: str, source: str) -> bool:
+    try:
+        return os.readlink(target) == source
+    except OSError:
+        return False
+
+
+def _drop_backup(entry: dict) -> None:
+    # the link was never made, so the target still holds the backed up file
+    if entry["backup"] and os.path.lexists(entry["backup"]):
+        if os.path.lexists(entry["target"]):
+            os.remove(entry["backup"])
+            logger.debug('removed "%s"', entry["backup"])
+
+
+def _remove_temp(entry: dict) -> None:
+    if os.path.lexists(entry["temp"]):
+        os.remove(entry["temp"])
+
+
+def unlink(link: Link, registry: Registry) -> None:
+    # only remove links which are still ours, restoring any backup
+    link_status = status(link)
+    if link_status in [OK, BROKEN]:
+        os.unlink(link.target)
+        logger.debug('removed "%s"', link.target)
+        if link.backup and os.path.lexists(link.backup):
+            os.rename(link.backup, link.target)
+            logger.debug('restored "%s"', link.backup)
+    elif link_status != MISSING:
+        logger.warning('not removing %s link "%s"', link_status, link.target)
+    registry.remove(link.target)
@@ -1,10 +1,52 @@
-from packagers.abstract import AbstractPackager
-from packagers.apt import Apt
-from packagers.brew import Brew
-from packagers.crontab import Crontab
-from packagers.dconf import Dconf
-from packagers.git import Git
-from packagers.npm import Npm
-from packagers.pipx import Pipx
+import importlib
+import os
+import typing
+
+if typing.TYPE_CHECKING:
+    from packagers.abstract import AbstractPackager
+
+# map package cli choice to "module:classname", imported only when used
+REGISTRY = {
+    "apt": "packagers.apt:Apt",
+    "brew": "packagers.brew:Brew",
+    "crontab": "packagers.crontab:Crontab",
+    "dconf": "packagers.dconf:Dconf",
+    "git": "packagers.git:Git",
+    "npm": "packagers.npm:Npm",
+    "pipx": "packagers.pipx:Pipx",
+}
+
+# public methods of AbstractPackager, listed here so the cli needs no import
+ACTIONS = ["backup", "diff", "info", "restore", "verify"]
+
+# third party packagers as "name=module:classname,..."
+REGISTRY_VARNAME = "FS_PACKAGERS"
 
 __all__ = ["AbstractPackager", "Apt", "Brew", "Crontab", "Dconf", "Git", "Npm", "Pipx"]
+
+
+def register(name: str, path: str) -> None:
+    if ":" not in path:
+        raise ValueError(f'packager "{path}" must be "module:classname"')
+    REGISTRY[name.lower()] = path
+
+
+def load(name: str) -> type["AbstractPackager"]:
+    module_name, _, class_name = REGISTRY[name].partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def __getattr__(name: str) -> typing.Any:
+    # keep "packagers.Apt" style access working without eager imports
+    if name == "AbstractPackager":
+        return importlib.import_module("packagers.abstract").AbstractPackager
+    for path in REGISTRY.values():
+        if path.endswith(f":{name}"):
+            module_name, _, class_name = path.partition(":")
+            return getattr(importlib.import_module(module_name), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+for item in filter(None, os.getenv(REGISTRY_VARNAME, "").split(",")):
+    name, _, path = item.partition("=")
+    register(name.strip(), path.strip())
@@ -1,6 +1,17 @@
+import contextlib
+import datetime
+import json
 import os
+import shlex
+import stat
+import tempfile
+import typing
 
-from utils import cmd
+from packagers import cache
+from utils import cmd, file_hash, write_atomic
+
+if typing.TYPE_CHECKING:
+    from snapshots import Snapshots
 
 
 class AbstractPackager(object):
@@ -10,6 +21,30 @@ class AbstractPackager(object):
     verifycmd = ""
     filepath = ""
 
+    # where restore and info read the backup, filepath unless set by the cli
+    readpath = ""
+
+    # packager cli choices which must be restored before this one
+    restore_after: list[str] = []
+
+    # package cli flags passed into the constructor
+    options: list[str] = []
+
+    # binary whose path and stat key the verify cache, verifycmd's by default
+    tool = ""
+
+    # answer verify from the cache while the tool is unchanged, and the
+    # version it reported
+    use_cache = True
+    version = ""
+
+    # print commands run while verifying, and diff as json instead of text
+    verbose = True
+    json_output = False
+
+    # history each backup is recorded into, set by the cli
+    snapshots: typing.Optional["Snapshots"] = None
+
     def __init__(
         self,
         info: str,
@@ -24,16 +59,148 @@ class AbstractPackager(object):
         self.restorecmd = restore
         self.verifycmd = verify
         self.filepath = os.path.join(file_dir, file_name)
+        self.readpath = self.filepath
 
     def verify(self) -> None:
-        cmd(self.verifycmd)
+        name = type(self).__name__.lower()
+        key = self.verify_key()
+        if key and self.use_cache:
+            entry = cache.load(name)
+            if entry.get("key") == key and entry.get("command") == self.verifycmd:
+                if self.verbose:
+                    print(f"$ {self.verifycmd} (cached)")
+                    print(entry["version"])
+                self.version = entry["version"]
+                return
+        try:
+            result = cmd(self.verifycmd, verbose=self.verbose)
+        except Exception as e:
+            cache.store(name, None)
+            raise e
+        self.version = self.parse_version(result.stdout or "")
+        if key:
+            entry = {"key": key, "command": self.verifycmd, "version": self.version}
+            cache.store(name, entry)
+
+    def verify_key(self) -> str:
+        # empty when availability cannot be cached
+        return cache.tool_key(self.tool or shlex.split(self.verifycmd)[0])
+
+    def parse_version(self, output: str) -> str:
+        return output.strip().split("\n")[0]
 
     def info(self) -> None:
-        cmd(self.infocmd.format(filepath=self.filepath))
+        cmd(self.infocmd.format(filepath=self.readpath))
 
     def backup(self) -> None:
-        cmd(self.backupcmd.format(filepath=self.filepath))
+        with self.backup_path() as temp_path:
+            cmd(self.backupcmd.format(filepath=temp_path))
         self.info()
 
     def restore(self) -> None:
-        cmd(self.restorecmd.format(filepath=self.filepath))
+        cmd(self.restorecmd.format(filepath=self.readpath))
+
+    def diff(self) -> None:
+        # compare the backup with what is installed, without changing either
+        name = type(self).__name__.lower()
+        changes = compare(self.saved(), self.live())
+        if self.json_output:
+            print(json.dumps({"packager": name, **changes}, sort_keys=True))
+            return
+        lines = [f"+ {k} {v}".rstrip() for k, v in sorted(changes["added"].items())]
+        lines += [f"- {k} {v}".rstrip() for k, v in sorted(changes["removed"].items())]
+        lines += [
+            f"~ {k} {v[0]} -> {v[1]}" for k, v in sorted(changes["changed"].items())
+        ]
+        print(os.linesep.join(lines) if lines else "no differences")
+
+    def saved(self) -> dict[str, str]:
+        # items in the backup, mapped to a version or value, "" when neither
+        raise NotImplementedError()
+
+    def live(self) -> dict[str, str]:
+        # installed items, keyed and valued like saved
+        raise NotImplementedError()
+
+    def fingerprint(self) -> str:
+        # cheap summary of installed state, empty when there is none
+        return ""
+
+    def unchanged(self, fingerprint: str) -> bool:
+        if not fingerprint or not os.path.isfile(self.filepath):
+            return False
+        state = self._read_state()
+        return state.get("fingerprint") == fingerprint and state.get(
+            "sha256"
+        ) == file_hash(self.filepath)
+
+    @contextlib.contextmanager
+    def backup_path(self, fingerprint: str = "") -> typing.Iterator[str]:
+        # temp file for commands to write into, only replaces the backup if
+        # content differs
+        file_dir, file_name = os.path.split(self.filepath)
+        fd, temp_path = tempfile.mkstemp(dir=file_dir, prefix=f".{file_name}.")
+        os.close(fd)
+        try:
+            yield temp_path
+            self._commit_backup(temp_path, fingerprint)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @contextlib.contextmanager
+    def open_backup(self, fingerprint: str = "") -> typing.Iterator[typing.TextIO]:
+        with self.backup_path(fingerprint) as temp_path:
+            with open(temp_path, "w") as f:
+                yield f
+
+    def _commit_backup(self, temp_path: str, fingerprint: str) -> None:
+        digest = file_hash(temp_path)
+        if os.path.isfile(self.filepath) and file_hash(self.filepath) == digest:
+            print(f'no changes to "{self.filepath}"')
+        else:
+            mode = 0o644
+            if os.path.isfile(self.filepath):
+                mode = stat.S_IMODE(os.stat(self.filepath).st_mode)
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, self.filepath)
+        self.readpath = self.filepath
+        if self.snapshots:
+            snapshot = self.snapshots.commit(self.filepath)
+            print(f"snapshot {snapshot.id}")
+
+        # only touch the state file when something in it changes
+        state = self._read_state()
+        version = self.version or state.get("version", "")
+        if (
+            state.get("sha256") != digest
+            or state.get("fingerprint") != fingerprint
+            or state.get("version", "") != version
+        ):
+            state["sha256"] = digest
+            state["fingerprint"] = fingerprint
+            state["version"] = version
+            state["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+            write_atomic(self._state_path(), f"{json.dumps(state, indent=4)}\n")
+
+    def _state_path(self) -> str:
+        file_dir, file_name = os.path.split(self.filepath)
+        return os.path.join(file_dir, f".{file_name}.state")
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self._state_path(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+
+def compare(saved: dict[str, str], live: dict[str, str]) -> dict[str, dict]:
+    # added is installed but not backed up, removed is backed up but missing
+    return {
+        "added": {k: v for k, v in live.items() if k not in saved},
+        "removed": {k: v for k, v in saved.items() if k not in live},
+        "changed": {
+            k: [v, live[k]] for k, v in saved.items() if k in live and live[k] != v
+        },
+    }
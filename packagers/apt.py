@@ -1,16 +1,61 @@
-
 import os
+import typing
 
-from packagers import AbstractPackager
-from packagers.exceptions import SudoException
+from packagers.abstract import AbstractPackager
+from packagers.cache import file_key
+from packagers.exceptions import RestoreException, SudoException
+from utils import stat_fingerprint
 
 try:
     import apt  # type: ignore
 except ModuleNotFoundError:
     pass
 
+DPKG_STATUS_PATH = "/var/lib/dpkg/status"
+EXTENDED_STATES_PATH = "/var/lib/apt/extended_states"
+
+# dpkg states in which a package has an installed version
+INSTALLED_STATES = [
+    "installed",
+    "half-configured",
+    "unpacked",
+    "half-installed",
+    "triggers-awaited",
+    "triggers-pending",
+]
+
+
+def parse_control(path: str) -> typing.Iterator[dict[str, str]]:
+    # stream paragraphs of a deb822 file, ignoring multi-line field values
+    paragraph: dict[str, str] = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line[0] in " \t#":
+                continue
+            if line == "\n":
+                if paragraph:
+                    yield paragraph
+                paragraph = {}
+                continue
+            name, _, value = line.partition(":")
+            paragraph[name] = value.strip()
+    if paragraph:
+        yield paragraph
+
+
 class Apt(AbstractPackager):
-    def __init__(self, file_dir: str, file_name: str = "apt.txt") -> None:
+    status_path = ""
+    extended_states_path = ""
+
+    def __init__(
+        self,
+        file_dir: str,
+        file_name: str = "apt.txt",
+        status_path: str = DPKG_STATUS_PATH,
+        extended_states_path: str = EXTENDED_STATES_PATH,
+    ) -> None:
+        self.status_path = status_path
+        self.extended_states_path = extended_states_path
         super().__init__(
             "cat {filepath}",
             "",
@@ -21,32 +66,88 @@ class Apt(AbstractPackager):
         )
 
     def backup(self) -> None:
-        try:
-            cache = apt.cache.Cache()
-            cache.update()
-            cache.open()
-            manual = [
-                pkg.name
-                for pkg in cache
-                if pkg.is_installed and not pkg.is_auto_installed
-            ]
-            with open(self.filepath, "w") as f:
-                f.write(os.linesep.join(manual))
+        fingerprint = self.fingerprint()
+        if self.unchanged(fingerprint):
+            print("no package changes since last backup")
             self.info()
-        except apt.cache.LockFailedException:
-            raise SudoException()
+            return
+        installed = self.installed()
+        manual = sorted(k for k, v in installed.items() if not v)
+        with self.open_backup(fingerprint) as f:
+            f.write(os.linesep.join(manual))
+        self.info()
+
+    def verify_key(self) -> str:
+        # restore needs python-apt itself, which dpkg -s checks for
+        module = globals().get("apt")
+        return file_key(module.__file__) if module else ""
+
+    def parse_version(self, output: str) -> str:
+        for line in output.split("\n"):
+            if line.startswith("Version:"):
+                return f"python3-apt {line.partition(':')[2].strip()}"
+        return ""
+
+    def fingerprint(self) -> str:
+        return stat_fingerprint([self.status_path, self.extended_states_path])
+
+    def installed(self) -> dict[str, bool]:
+        # map installed package names, as python-apt names them, to auto flag
+        packages = []
+        native = ""
+        for paragraph in parse_control(self.status_path):
+            state = paragraph.get("Status", "").split(" ")[-1]
+            if state not in INSTALLED_STATES:
+                continue
+            name = paragraph.get("Package", "")
+            architecture = paragraph.get("Architecture", "")
+            packages.append((name, architecture))
+            if name == "dpkg":
+                native = architecture
+
+        # apt records arch independent packages under the native arch
+        auto = set()
+        if os.path.isfile(self.extended_states_path):
+            for paragraph in parse_control(self.extended_states_path):
+                if paragraph.get("Auto-Installed") == "1":
+                    auto.add((paragraph.get("Package"), paragraph.get("Architecture")))
+
+        installed = {}
+        for name, architecture in packages:
+            if architecture == "all":
+                architecture = native
+            if architecture != native:
+                installed[f"{name}:{architecture}"] = (name, architecture) in auto
+            else:
+                installed[name] = (name, architecture) in auto
+        return installed
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return {line.strip(): "" for line in f.readlines() if line.strip()}
+
+    def live(self) -> dict[str, str]:
+        return {k: "" for k, v in self.installed().items() if not v}
 
     def restore(self) -> None:
+        packages = list(self.saved())
+        installed = self.installed()
+        missing = [x for x in packages if x not in installed]
+        if not missing:
+            print("all packages already installed")
+            return
+
         try:
-            with open(self.filepath, "r") as f:
-                packages = [line.strip() for line in f.readlines()]
             cache = apt.cache.Cache()
             cache.update()
             cache.open()
+            unknown = [x for x in missing if x not in cache]
+            if unknown:
+                raise RestoreException(f"unknown packages: {' '.join(unknown)}")
+            print(f"installing {' '.join(missing)}")
             with cache.actiongroup():
-                for package in [cache[x] for x in packages]:
-                    if not package.is_installed:
-                        package.mark_install()
+                for x in missing:
+                    cache[x].mark_install()
             cache.commit()
-        except apt.cache.LockFailedException:
-            raise SudoException()
+        except apt.cache.LockFailedException as e:
+            raise SudoException() from e
@@ -1,4 +1,10 @@
-from packagers import AbstractPackager
+import re
+
+from packagers.abstract import AbstractPackager
+from utils import cmd
+
+# Brewfile entries like 'brew "name", args: [...]', comments skipped
+ENTRY = re.compile(r'^(\w+)\s+"([^"]+)"(.*)$')
 
 
 class Brew(AbstractPackager):
@@ -11,3 +17,19 @@ class Brew(AbstractPackager):
             file_dir,
             file_name,
         )
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return self._entries(f.read())
+
+    def live(self) -> dict[str, str]:
+        return self._entries(cmd("brew bundle dump --file=-", verbose=False).stdout)
+
+    def _entries(self, text: str) -> dict[str, str]:
+        entries = {}
+        for line in text.splitlines():
+            match = ENTRY.match(line.strip())
+            if match:
+                kind, name, rest = match.groups()
+                entries[f"{kind} {name}"] = rest.lstrip(", ")
+        return entries
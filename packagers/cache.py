@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import threading
+import typing
+
+from utils import CACHE_DIR, write_atomic
+
+VERIFY_CACHE_PATH = os.path.join(CACHE_DIR, "verify.json")
+
+# packagers verify concurrently from "package all"
+lock = threading.Lock()
+
+
+def tool_key(tool: str) -> str:
+    # changes whenever the binary found on PATH is moved, replaced or upgraded
+    path = shutil.which(tool)
+    if not path:
+        return ""
+    return file_key(os.path.realpath(path))
+
+
+def file_key(path: str) -> str:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{path}:{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}"
+
+
+def load(name: str) -> dict:
+    return _read().get(name, {})
+
+
+def store(name: str, entry: typing.Optional[dict]) -> None:
+    with lock:
+        data = _read()
+        if entry is None:
+            if name not in data:
+                return
+            del data[name]
+        elif data.get(name) == entry:
+            return
+        else:
+            data[name] = entry
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_atomic(VERIFY_CACHE_PATH, f"{json.dumps(data, indent=4)}\n")
+
+
+def _read() -> dict:
+    try:
+        with open(VERIFY_CACHE_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
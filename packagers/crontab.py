@@ -1,9 +1,13 @@
-from utils import cmd
+import subprocess
 
-from packagers import AbstractPackager
+from utils import cmd, cmd_stream
+
+from packagers.abstract import AbstractPackager
 
 
 class Crontab(AbstractPackager):
+    tool = "crontab"
+
     def __init__(self, file_dir: str, file_name: str = "crontab.txt") -> None:
         super().__init__(
             "cat {filepath}",
@@ -15,6 +19,23 @@ class Crontab(AbstractPackager):
         )
 
     def backup(self) -> None:
-        with open(self.filepath, "w") as f:
-            cmd(self.backupcmd, stdout=f)
-            self.info()
+        with self.open_backup() as f:
+            cmd_stream(self.backupcmd, tee=f)
+        self.info()
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return self._entries(f.read())
+
+    def live(self) -> dict[str, str]:
+        try:
+            return self._entries(cmd(self.backupcmd, verbose=False).stdout)
+        except subprocess.CalledProcessError as e:
+            # crontab exits non-zero for users without one
+            if "no crontab" in (e.stderr or ""):
+                return {}
+            raise e
+
+    def _entries(self, text: str) -> dict[str, str]:
+        lines = [x.strip() for x in text.splitlines()]
+        return {x: "" for x in lines if x and not x.startswith("#")}
@@ -1,12 +1,68 @@
-from utils import cmd
+import os
+import typing
+
+from utils import cmd, stream
+
+from packagers.abstract import AbstractPackager
+
+# comma separated dconf dirs to back up when --subtree is not given
+SUBTREES_VARNAME = "FS_DCONF_SUBTREES"
+
+Settings = dict[str, dict[str, str]]
+
+
+def normalize_dir(path: str) -> str:
+    # dconf dirs start and end with a slash
+    path = path.strip("/")
+    return f"/{path}/" if path else "/"
+
+
+def parse_keyfile(lines: typing.Iterable[str], root: str = "/") -> Settings:
+    # map absolute dconf dir to its keys, from "dconf dump" output of root
+    settings: Settings = {}
+    section: typing.Optional[dict[str, str]] = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            name = line[1:-1].strip("/")
+            path = normalize_dir(f"{root}{name}")
+            section = settings.setdefault(path, {})
+        elif section is not None:
+            key, _, value = line.partition("=")
+            section[key.strip()] = value.strip()
+    return settings
+
+
+def format_keyfile(settings: Settings) -> str:
+    # sorted dirs and keys, loadable with "dconf load /"
+    sections = []
+    for path in sorted(settings):
+        if not settings[path]:
+            continue
+        lines = [f"[{path.strip('/') or '/'}]"]
+        lines += [f"{k}={v}" for k, v in sorted(settings[path].items())]
+        sections.append("\n".join(lines))
+    return "".join(f"{x}\n\n" for x in sections)
 
-from packagers import AbstractPackager
 
 class Dconf(AbstractPackager):
-    def __init__(self, file_dir: str, file_name: str = "settings.dconf") -> None:
+    subtrees: list[str] = []
+    options = ["subtrees"]
+
+    def __init__(
+        self,
+        file_dir: str,
+        file_name: str = "settings.dconf",
+        subtrees: typing.Optional[list[str]] = None,
+    ) -> None:
+        if not subtrees:
+            subtrees = os.getenv(SUBTREES_VARNAME, "/").split(",")
+        self.subtrees = sorted({normalize_dir(x) for x in subtrees if x.strip()})
         super().__init__(
             "cat {filepath}",
-            "dconf dump /",
+            "dconf dump {subtree}",
             "dconf load /",
             "dconf help",
             file_dir,
@@ -14,10 +70,51 @@ class Dconf(AbstractPackager):
         )
 
     def backup(self) -> None:
-        with open(self.filepath, "w") as f:
-            cmd(self.backupcmd, stdout=f)
-            self.info()
+        settings = self.dump()
+        with self.open_backup() as f:
+            f.write(format_keyfile(settings))
+        self.info()
 
     def restore(self) -> None:
-        with open(self.filepath, "r") as f:
-            cmd(self.restorecmd, input=f.read())
+        # only load keys which differ, each load fires a change signal
+        with open(self.readpath, "r") as f:
+            saved = self._in_subtrees(parse_keyfile(f))
+        live = self.dump()
+        changed: Settings = {}
+        for path, keys in saved.items():
+            for key, value in keys.items():
+                if live.get(path, {}).get(key) != value:
+                    changed.setdefault(path, {})[key] = value
+        if not changed:
+            print("all settings already match")
+            return
+        count = sum(len(x) for x in changed.values())
+        print(f"loading {count} changed keys")
+        cmd(self.restorecmd, input=format_keyfile(changed))
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return _flatten(self._in_subtrees(parse_keyfile(f)))
+
+    def live(self) -> dict[str, str]:
+        return _flatten(self.dump())
+
+    def dump(self) -> Settings:
+        settings: Settings = {}
+        for subtree in self.subtrees:
+            command = self.backupcmd.format(subtree=subtree)
+            if self.verbose:
+                print(f"$ {command}")
+            settings.update(parse_keyfile(stream(command), subtree))
+        return settings
+
+    def _in_subtrees(self, settings: Settings) -> Settings:
+        return {
+            k: v
+            for k, v in settings.items()
+            if any(k.startswith(x) for x in self.subtrees)
+        }
+
+
+def _flatten(settings: Settings) -> dict[str, str]:
+    return {f"{path}{k}": v for path, keys in settings.items() for k, v in keys.items()}
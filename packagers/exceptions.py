@@ -1,3 +1,11 @@
 
 class SudoException(Exception):
     pass
+
+
+class GitConfigException(Exception):
+    pass
+
+
+class RestoreException(Exception):
+    pass
@@ -1,15 +1,23 @@
+import concurrent.futures
 import json
 import os
 import subprocess
+import typing
 
-from utils import cmd
+from utils import cmd, print_table, stat_fingerprint
 
-from packagers import AbstractPackager
+from packagers.abstract import AbstractPackager
+from packagers.exceptions import GitConfigException, RestoreException
+from packagers.gitconfig import RemoteReader
 
 
 class Git(AbstractPackager):
     install_dir = ""
     default_remote = ""
+    jobs = 1
+    depth = 0
+    clone_filter = ""
+    options = ["jobs", "depth", "clone_filter"]
 
     def __init__(
         self,
@@ -17,61 +25,160 @@ class Git(AbstractPackager):
         file_name: str = "git_repos.json",
         install_dir: str = "",
         remote: str = "origin",
+        jobs: int = 1,
+        depth: int = 0,
+        clone_filter: str = "",
     ):
         if not install_dir:
             install_dir = os.path.join(os.path.expanduser("~"), "projects")
         self.install_dir = install_dir
         self.default_remote = remote
+        self.jobs = max(jobs, 1)
+        self.depth = depth
+        self.clone_filter = clone_filter
         super().__init__("cat {filepath}", "", "", "git --version", file_dir, file_name)
 
     def backup(self) -> None:
         if not os.path.isdir(self.install_dir):
             os.makedirs(self.install_dir)
+        fingerprint = self.fingerprint()
+        if self.unchanged(fingerprint):
+            print(f'no changes in "{self.install_dir}" since last backup')
+            self.info()
+            return
 
-        # query for all repo names and remote urls
+        # save to backup file
+        json_results = json.dumps(self._repos(), indent=4, sort_keys=True)
+        with self.open_backup(fingerprint) as f:
+            f.write(f"{json_results}\n")
+        self.info()
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return self._remotes(json.load(f))
+
+    def live(self) -> dict[str, str]:
+        if not os.path.isdir(self.install_dir):
+            return {}
+        return self._remotes(self._repos())
+
+    def _repos(self) -> dict[str, dict]:
+        # read remotes from config files, asking git only when unsure
+        reader = RemoteReader()
         results = {}
         for name in os.listdir(self.install_dir):
             full_path = os.path.join(self.install_dir, name)
             if os.path.isdir(full_path):
                 try:
-                    remotes = (
-                        cmd(f"git -C {full_path} remote").stdout.rstrip().split("\n")
-                    )
-                    results[name] = {
-                        "remotes": {
-                            remote: cmd(
-                                f"git -C {full_path} remote get-url {remote}"
-                            ).stdout.rstrip()
-                            for remote in remotes
-                        }
-                    }
-                except subprocess.CalledProcessError:
-                    pass
+                    remotes = reader.read(full_path)
+                except (GitConfigException, OSError):
+                    remotes = self._query_remotes(full_path)
+                if remotes:
+                    results[name] = {"remotes": remotes}
+        return results
 
-        # save to backup file
-        json_results = json.dumps(results, indent=4, sort_keys=True)
-        with open(self.filepath, "w") as f:
-            f.write(f"{json_results}\n")
-        self.info()
+    def _remotes(self, repos: dict[str, dict]) -> dict[str, str]:
+        # one item per remote of each repo, valued by url
+        return {
+            f"{name} {remote}": url
+            for name, conf in repos.items()
+            for remote, url in conf["remotes"].items()
+        }
+
+    def fingerprint(self) -> str:
+        # repo listing plus the mtime of every config file remotes are read
+        # from, empty when only git can tell which those are
+        reader = RemoteReader()
+        paths = []
+        try:
+            for name in sorted(os.listdir(self.install_dir)):
+                full_path = os.path.join(self.install_dir, name)
+                if os.path.isdir(full_path):
+                    paths += [full_path, os.path.join(full_path, ".git")]
+                    paths += reader.config_paths(full_path)
+        except (GitConfigException, OSError):
+            return ""
+        return stat_fingerprint(dict.fromkeys(paths))
+
+    def _query_remotes(self, full_path: str) -> typing.Optional[dict[str, str]]:
+        try:
+            remotes = cmd(f"git -C {full_path} remote", verbose=self.verbose)
+            return {
+                remote: cmd(
+                    f"git -C {full_path} remote get-url {remote}",
+                    verbose=self.verbose,
+                ).stdout.rstrip()
+                for remote in remotes.stdout.rstrip().split("\n")
+            }
+        except subprocess.CalledProcessError:
+            return None
 
     def restore(self) -> None:
         if not os.path.isdir(self.install_dir):
             os.makedirs(self.install_dir)
-        with open(self.filepath, "r") as f:
+        with open(self.readpath, "r") as f:
             data = json.load(f)
-            for name, conf in data.items():
+
+        # clone with a bounded pool, collecting a result per repo
+        reader = RemoteReader()
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(self._restore_repo, reader, name, conf["remotes"])
+                for name, conf in sorted(data.items())
+            ]
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                result = future.result()
+                results.append(result)
+                print(f"[{i + 1}/{len(futures)}] {result[0]}: {result[1]}")
+
+        print("")
+        print_table(["repo", "result", "detail"], sorted(results))
+        failed = sorted(x[0] for x in results if x[1] == "failed")
+        if failed:
+            raise RestoreException(f"failed to restore {len(failed)} repos: {failed}")
+
+    def _restore_repo(
+        self, reader: RemoteReader, name: str, remotes: dict[str, str]
+    ) -> tuple[str, str, str]:
+        full_path = os.path.join(self.install_dir, name)
+        try:
+            # only fix up remotes of repos which already exist
+            if os.path.exists(full_path) and not self._is_empty_dir(full_path):
                 try:
-                    # clone into dir
-                    remotes = conf["remotes"]
-                    full_path = os.path.join(self.install_dir, name)
-                    default_remote = remotes[self.default_remote]
-                    cmd(f"git clone {default_remote} {full_path}")
-
-                    # setup remotes
-                    for k, v in remotes.items():
-                        if k != self.default_remote:
-                            cmd(f"git -C {full_path} remote add {k} {v}")
-                        else:
-                            cmd(f"git -C {full_path} remote set-url {k} {v}")
-                except subprocess.CalledProcessError:
-                    pass
+                    existing = reader.read(full_path)
+                except (GitConfigException, OSError):
+                    existing = self._query_remotes(full_path)
+                if existing is None:
+                    return name, "failed", "exists and is not a git repo"
+                if existing == remotes:
+                    return name, "skipped", "remotes match"
+                self._set_remotes(full_path, remotes, existing)
+                return name, "updated", "remotes changed"
+
+            if self.default_remote not in remotes:
+                return name, "failed", f'no "{self.default_remote}" remote'
+            options = f"-o {self.default_remote}"
+            if self.depth:
+                options += f" --depth {self.depth}"
+            if self.clone_filter:
+                options += f" --filter={self.clone_filter}"
+            default_url = remotes[self.default_remote]
+            cmd(f"git clone {options} {default_url} {full_path}", verbose=False)
+            self._set_remotes(full_path, remotes, {self.default_remote: default_url})
+            return name, "cloned", default_url
+        except subprocess.CalledProcessError as e:
+            lines = (e.stderr or "").strip().splitlines()
+            return name, "failed", lines[-1] if lines else str(e)
+
+    def _is_empty_dir(self, path: str) -> bool:
+        return os.path.isdir(path) and not os.listdir(path)
+
+    def _set_remotes(
+        self, full_path: str, remotes: dict[str, str], existing: dict[str, str]
+    ) -> None:
+        for k, v in remotes.items():
+            if k not in existing:
+                cmd(f"git -C {full_path} remote add {k} {v}", verbose=False)
+            elif existing[k] != v:
+                cmd(f"git -C {full_path} remote set-url {k} {v}", verbose=False)
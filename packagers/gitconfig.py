@@ -0,0 +1,455 @@
+import os
+import re
+import shutil
+import typing
+
+from packagers.exceptions import GitConfigException
+
+# (section, subsection, key, value) with section and key lowercased
+Entry = typing.Tuple[str, typing.Optional[str], str, typing.Optional[str]]
+
+MAX_INCLUDE_DEPTH = 10
+
+# env vars which change how git finds repos or config, not worth emulating
+UNSUPPORTED_ENV = [
+    "GIT_DIR",
+    "GIT_WORK_TREE",
+    "GIT_COMMON_DIR",
+    "GIT_CONFIG",
+    "GIT_CONFIG_PARAMETERS",
+    "GIT_CONFIG_COUNT",
+]
+
+
+def parse_config(text: str) -> list[Entry]:
+    # port of the parser in git's config.c
+    entries: list[Entry] = []
+    section = ""
+    subsection: typing.Optional[str] = None
+    pos = 0
+    end = len(text)
+    if text.startswith("\ufeff"):
+        pos = 1
+
+    def error(message: str) -> GitConfigException:
+        line = text.count("\n", 0, pos) + 1
+        return GitConfigException(f"bad config line {line}: {message}")
+
+    while pos < end:
+        c = text[pos]
+        pos += 1
+        if c.isspace():
+            continue
+        if c in "#;":
+            newline = text.find("\n", pos)
+            pos = end if newline == -1 else newline + 1
+            continue
+        if c == "[":
+            pos, section, subsection = _parse_section(text, pos, error)
+            continue
+        if not c.isalpha():
+            raise error(f'unexpected "{c}"')
+        if not section:
+            raise error("key outside of section")
+
+        # key is alphanumeric or dashes
+        start = pos - 1
+        while pos < end and (text[pos].isalnum() or text[pos] == "-"):
+            pos += 1
+        key = text[start:pos].lower()
+        while pos < end and text[pos] in " \t":
+            pos += 1
+
+        # key without a value is a boolean true
+        if pos >= end or text[pos] == "\n":
+            entries.append((section, subsection, key, None))
+            continue
+        if text[pos] != "=":
+            raise error(f'expected "=" after "{key}"')
+        pos, value = _parse_value(text, pos + 1, error)
+        entries.append((section, subsection, key, value))
+    return entries
+
+
+def _parse_section(
+    text: str, pos: int, error: typing.Callable[[str], GitConfigException]
+) -> tuple[int, str, typing.Optional[str]]:
+    name: list[str] = []
+    while True:
+        if pos >= len(text) or text[pos] == "\n":
+            raise error("unterminated section header")
+        c = text[pos]
+        pos += 1
+        if c == "]":
+            break
+        if c.isspace():
+            return _parse_subsection(text, pos, "".join(name), error)
+        if not (c.isalnum() or c in "-."):
+            raise error(f'invalid section name character "{c}"')
+        name.append(c.lower())
+
+    # deprecated [section.subsection] syntax
+    section, dot, subsection = "".join(name).partition(".")
+    if not section:
+        raise error("empty section name")
+    return pos, section, subsection if dot else None
+
+
+def _parse_subsection(
+    text: str,
+    pos: int,
+    section: str,
+    error: typing.Callable[[str], GitConfigException],
+) -> tuple[int, str, typing.Optional[str]]:
+    while pos < len(text) and text[pos] in " \t":
+        pos += 1
+    if pos >= len(text) or text[pos] != '"':
+        raise error("expected quoted subsection")
+    pos += 1
+    subsection: list[str] = []
+    while True:
+        if pos >= len(text) or text[pos] == "\n":
+            raise error("unterminated subsection")
+        c = text[pos]
+        pos += 1
+        if c == '"':
+            break
+        if c == "\\":
+            if pos >= len(text) or text[pos] == "\n":
+                raise error("unterminated subsection")
+            c = text[pos]
+            pos += 1
+        subsection.append(c)
+    if pos >= len(text) or text[pos] != "]":
+        raise error('expected "]" after subsection')
+    return pos + 1, section, "".join(subsection)
+
+
+def _parse_value(
+    text: str, pos: int, error: typing.Callable[[str], GitConfigException]
+) -> tuple[int, str]:
+    escapes = {"t": "\t", "b": "\b", "n": "\n", "\\": "\\", '"': '"'}
+    value: list[str] = []
+    space = 0
+    quote = False
+    comment = False
+    while True:
+        if pos >= len(text) or text[pos] == "\n":
+            if quote:
+                raise error("unterminated quoted value")
+            return pos + 1, "".join(value)
+        c = text[pos]
+        pos += 1
+        if comment:
+            continue
+        if c.isspace() and not quote:
+            if value:
+                space += 1
+            continue
+        if not quote and c in "#;":
+            comment = True
+            continue
+        value.extend(" " * space)
+        space = 0
+        if c == "\\":
+            if pos >= len(text):
+                raise error("unterminated escape")
+            c = text[pos]
+            pos += 1
+            if c == "\n":
+                continue
+            if c not in escapes:
+                raise error(f'invalid escape "\\{c}"')
+            value.append(escapes[c])
+        elif c == '"':
+            quote = not quote
+        else:
+            value.append(c)
+
+
+def wildmatch(pattern: str, text: str, ignore_case: bool = False) -> bool:
+    # subset of git's wildmatch with WM_PATHNAME, enough for include conditions
+    regex = []
+    pos = 0
+    while pos < len(pattern):
+        c = pattern[pos]
+        if pattern.startswith("**", pos):
+            at_start = pos == 0 or pattern[pos - 1] == "/"
+            after = pos + 2
+            if at_start and pattern.startswith("/", after):
+                regex.append("(?:.*/)?")
+                pos = after + 1
+                continue
+            if at_start and after == len(pattern):
+                regex.append(".*")
+                pos = after
+                continue
+            regex.append("[^/]*")
+            pos = after
+        elif c == "*":
+            regex.append("[^/]*")
+            pos += 1
+        elif c == "?":
+            regex.append("[^/]")
+            pos += 1
+        elif c == "[":
+            close = pattern.find("]", pos + 2)
+            if close == -1 or "[:" in pattern[pos:close]:
+                raise GitConfigException(f'unsupported pattern "{pattern}"')
+            body = pattern[pos + 1 : close]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            regex.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+            pos = close + 1
+        elif c == "\\" and pos + 1 < len(pattern):
+            regex.append(re.escape(pattern[pos + 1]))
+            pos += 2
+        else:
+            regex.append(re.escape(c))
+            pos += 1
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.fullmatch("".join(regex), text, flags) is not None
+
+
+class RemoteReader(object):
+    home_dir = ""
+
+    def __init__(self, home_dir: str = "") -> None:
+        self.home_dir = home_dir or os.path.expanduser("~")
+        self.cache: dict[str, list[Entry]] = {}
+        self.parent_repos: dict[str, bool] = {}
+
+    def read(self, repo_dir: str) -> typing.Optional[dict[str, str]]:
+        # returns None if dir is not a repo, raises if git must decide
+        for name in UNSUPPORTED_ENV:
+            if name in os.environ:
+                raise GitConfigException(f'"${name}" is set')
+        layout = self._locate(repo_dir)
+        if layout is None:
+            return None
+        git_dir, common_dir = layout
+        if os.stat(repo_dir).st_uid != os.geteuid():
+            raise GitConfigException(f'"{repo_dir}" is owned by another user')
+
+        entries = self._config_entries(git_dir, common_dir)
+        for name in ["remotes", "branches"]:
+            legacy_dir = os.path.join(common_dir, name)
+            if os.path.isdir(legacy_dir) and os.listdir(legacy_dir):
+                raise GitConfigException(f'legacy remotes in "{legacy_dir}"')
+
+        # collect remotes in order of appearance
+        urls: dict[str, list[str]] = {}
+        rewrites: dict[str, list[str]] = {}
+        for section, subsection, key, value in entries:
+            if section == "core" and key == "repositoryformatversion":
+                if value not in ["0", "1"]:
+                    raise GitConfigException(f"repository format {value}")
+            if subsection is None:
+                continue
+            if section == "remote":
+                remote_urls = urls.setdefault(subsection, [])
+                if key == "url":
+                    if not value:
+                        raise GitConfigException(f'empty url for "{subsection}"')
+                    remote_urls.append(value)
+            elif section == "url" and key == "insteadof" and value is not None:
+                rewrites.setdefault(subsection, []).append(value)
+
+        remotes = {}
+        for remote, remote_urls in urls.items():
+            if not remote_urls:
+                raise GitConfigException(f'remote "{remote}" has no url')
+            remotes[remote] = self._rewrite(remote_urls[0], rewrites)
+        return remotes
+
+    def config_paths(self, repo_dir: str) -> list[str]:
+        # every file read consults for repo_dir's remotes, includes followed
+        layout = self._locate(repo_dir)
+        if layout is None:
+            return []
+        paths: list[str] = []
+        self._config_entries(*layout, paths=paths)
+        return paths
+
+    def _locate(self, repo_dir: str) -> typing.Optional[tuple[str, str]]:
+        dot_git = os.path.join(repo_dir, ".git")
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+        elif os.path.isfile(dot_git):
+            with open(dot_git, "r") as f:
+                contents = f.read().strip()
+            if not contents.startswith("gitdir:"):
+                raise GitConfigException(f'unreadable "{dot_git}"')
+            git_dir = os.path.join(repo_dir, contents[len("gitdir:") :].strip())
+        elif self._is_git_dir(repo_dir):
+            git_dir = repo_dir
+        elif self._has_parent_repo(os.path.dirname(repo_dir)):
+            raise GitConfigException(f'"{repo_dir}" may belong to a parent repo')
+        else:
+            return None
+        git_dir = os.path.normpath(git_dir)
+        if not self._is_git_dir(git_dir):
+            raise GitConfigException(f'"{git_dir}" is not a git dir')
+
+        # linked worktrees share the config of the main repo
+        common_dir = git_dir
+        commondir_file = os.path.join(git_dir, "commondir")
+        if os.path.isfile(commondir_file):
+            with open(commondir_file, "r") as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+        return git_dir, os.path.normpath(common_dir)
+
+    def _is_git_dir(self, path: str) -> bool:
+        return os.path.isfile(os.path.join(path, "HEAD")) and (
+            os.path.isdir(os.path.join(path, "objects"))
+            or os.path.isfile(os.path.join(path, "commondir"))
+        )
+
+    def _has_parent_repo(self, path: str) -> bool:
+        if path not in self.parent_repos:
+            parent = os.path.dirname(path)
+            self.parent_repos[path] = (
+                os.path.exists(os.path.join(path, ".git"))
+                or self._is_git_dir(path)
+                or (parent != path and self._has_parent_repo(parent))
+            )
+        return self.parent_repos[path]
+
+    def _config_entries(
+        self,
+        git_dir: str,
+        common_dir: str,
+        paths: typing.Optional[list[str]] = None,
+    ) -> list[Entry]:
+        context = (git_dir, self._branch(git_dir))
+        entries: list[Entry] = []
+        for path in self.system_paths() + self.global_paths():
+            entries += self._load(path, context, 0, paths)
+        entries += self._load(os.path.join(common_dir, "config"), context, 0, paths)
+        worktree_config = any(
+            section == "extensions"
+            and key == "worktreeconfig"
+            and (value or "true").lower() in ["true", "yes", "on", "1"]
+            for section, _, key, value in entries
+        )
+        if worktree_config:
+            worktree_path = os.path.join(git_dir, "config.worktree")
+            entries += self._load(worktree_path, context, 0, paths)
+        return entries
+
+    def system_paths(self) -> list[str]:
+        if os.getenv("GIT_CONFIG_NOSYSTEM", "").lower() in ["1", "true", "yes"]:
+            return []
+        if "GIT_CONFIG_SYSTEM" in os.environ:
+            return [os.environ["GIT_CONFIG_SYSTEM"]]
+
+        # sysconfdir is /etc for a /usr prefix, otherwise relative to prefix
+        git_path = shutil.which("git")
+        if not git_path:
+            raise GitConfigException("git not found on path")
+        prefix = os.path.dirname(os.path.dirname(os.path.realpath(git_path)))
+        if prefix == "/usr":
+            return ["/etc/gitconfig"]
+        return [os.path.join(prefix, "etc", "gitconfig")]
+
+    def global_paths(self) -> list[str]:
+        if "GIT_CONFIG_GLOBAL" in os.environ:
+            return [os.environ["GIT_CONFIG_GLOBAL"]]
+        xdg_dir = os.getenv("XDG_CONFIG_HOME") or os.path.join(self.home_dir, ".config")
+        return [
+            os.path.join(xdg_dir, "git", "config"),
+            os.path.join(self.home_dir, ".gitconfig"),
+        ]
+
+    def _branch(self, git_dir: str) -> typing.Optional[str]:
+        with open(os.path.join(git_dir, "HEAD"), "r") as f:
+            head = f.read().strip()
+        prefix = "ref: refs/heads/"
+        return head[len(prefix) :] if head.startswith(prefix) else None
+
+    def _parse(self, path: str) -> list[Entry]:
+        if path not in self.cache:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.cache[path] = parse_config(f.read())
+            except FileNotFoundError:
+                self.cache[path] = []
+            except (OSError, UnicodeDecodeError) as e:
+                raise GitConfigException(f'unreadable "{path}": {e}') from e
+        return self.cache[path]
+
+    def _load(
+        self,
+        path: str,
+        context: tuple[str, typing.Optional[str]],
+        depth: int,
+        paths: typing.Optional[list[str]] = None,
+    ) -> list[Entry]:
+        if depth > MAX_INCLUDE_DEPTH:
+            raise GitConfigException(f'include depth exceeded at "{path}"')
+        if paths is not None:
+            paths.append(path)
+        entries = []
+        for entry in self._parse(path):
+            entries.append(entry)
+            section, subsection, key, value = entry
+            if key != "path" or not value:
+                continue
+            included = section == "include" and subsection is None
+            if section == "includeif" and subsection is not None:
+                included = self._condition(subsection, path, context)
+                if paths is not None and subsection.startswith("onbranch:"):
+                    # checking out another branch can change what is included
+                    paths.append(os.path.join(context[0], "HEAD"))
+            if included:
+                include_path = self._expand(value, os.path.dirname(path))
+                entries += self._load(include_path, context, depth + 1, paths)
+        return entries
+
+    def _expand(self, path: str, base_dir: str) -> str:
+        if path == "~" or path.startswith("~/"):
+            path = self.home_dir + path[1:]
+        return os.path.join(base_dir, path)
+
+    def _condition(
+        self,
+        condition: str,
+        config_path: str,
+        context: tuple[str, typing.Optional[str]],
+    ) -> bool:
+        git_dir, branch = context
+        kind, _, pattern = condition.partition(":")
+        if kind in ["gitdir", "gitdir/i"]:
+            if pattern.startswith("./"):
+                pattern = os.path.dirname(config_path) + pattern[1:]
+            elif pattern == "~" or pattern.startswith("~/"):
+                pattern = self.home_dir + pattern[1:]
+            if not os.path.isabs(pattern):
+                pattern = "**/" + pattern
+            if pattern.endswith("/"):
+                pattern += "**"
+            ignore_case = kind == "gitdir/i"
+            return any(
+                wildmatch(pattern, x, ignore_case)
+                for x in [os.path.abspath(git_dir), os.path.realpath(git_dir)]
+            )
+        if kind == "onbranch":
+            if pattern.endswith("/"):
+                pattern += "**"
+            return branch is not None and wildmatch(pattern, branch)
+        if kind == "hasconfig":
+            raise GitConfigException(f'unsupported includeIf "{condition}"')
+        return False
+
+    def _rewrite(self, url: str, rewrites: dict[str, list[str]]) -> str:
+        # longest insteadOf prefix wins, first defined base breaks ties
+        best_base = None
+        best_length = 0
+        for base, prefixes in rewrites.items():
+            for prefix in prefixes:
+                if url.startswith(prefix) and len(prefix) > best_length:
+                    best_base = base
+                    best_length = len(prefix)
+        if best_base is None:
+            return url
+        return best_base + url[best_length:]
@@ -1,29 +1,77 @@
 import json
+import subprocess
 
 from utils import cmd
 
-from packagers import AbstractPackager
+from packagers.abstract import AbstractPackager
+
+# keep batched install commands well under any platform's ARG_MAX
+MAX_COMMAND_LENGTH = 32768
 
 
 class Npm(AbstractPackager):
+    restore_after = ["brew"]
+
     def __init__(self, file_dir: str, file_name: str = "package.json") -> None:
         super().__init__(
             "cat {filepath}",
-            "npm list -g --json",
-            "npm install -g {package}",
+            "npm list -g --depth=0 --json",
+            "npm install -g {packages}",
             "npm --version",
             file_dir,
             file_name,
         )
 
     def backup(self) -> None:
-        with open(self.filepath, "w") as f:
-            cmd(self.backupcmd, stdout=f)
-            self.info()
+        # compact manifest of top level packages only
+        manifest = {"dependencies": self._installed()}
+        with self.open_backup() as f:
+            f.write(f"{json.dumps(manifest, indent=4, sort_keys=True)}\n")
+        self.info()
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            return self._versions(json.load(f))
+
+    def live(self) -> dict[str, str]:
+        return self._installed()
 
     def restore(self) -> None:
-        with open(self.filepath, "r") as f:
-            data = json.load(f)
-            for k, v in data["dependencies"].items():
-                package = "@".join([k, v["version"]])
-                cmd(self.restorecmd.format(package=package))
+        saved = self.saved()
+        installed = self._installed()
+        packages = [
+            f"{k}@{v}" for k, v in sorted(saved.items()) if installed.get(k) != v
+        ]
+        if not packages:
+            print("all packages already installed")
+            return
+
+        # one install per chunk of arguments instead of one per package
+        restorecmd = self.restorecmd.format(packages="")
+        chunk: list[str] = []
+        for package in packages:
+            length = len(restorecmd) + sum(len(x) + 1 for x in chunk + [package])
+            if chunk and length > MAX_COMMAND_LENGTH:
+                cmd(self.restorecmd.format(packages=" ".join(chunk)))
+                chunk = []
+            chunk.append(package)
+        cmd(self.restorecmd.format(packages=" ".join(chunk)))
+
+    def _installed(self) -> dict[str, str]:
+        try:
+            output = cmd(self.backupcmd, verbose=False).stdout
+        except subprocess.CalledProcessError as e:
+            # npm exits non-zero on extraneous or invalid packages
+            if not e.stdout:
+                raise e
+            output = e.stdout
+        return self._versions(json.loads(output))
+
+    def _versions(self, data: dict) -> dict[str, str]:
+        # legacy manifests store the full "npm list" tree per package
+        versions = {}
+        for k, v in data.get("dependencies", {}).items():
+            version = v.get("version") if isinstance(v, dict) else v
+            if version:
+                versions[k] = version
+        return versions
@@ -1,20 +1,154 @@
-from utils import cmd
+import concurrent.futures
+import json
+import os
+import shlex
+import subprocess
+import typing
 
-from packagers import AbstractPackager
+from utils import cmd, cmd_stream, print_table
+
+from packagers.abstract import AbstractPackager
+from packagers.exceptions import RestoreException
 
 
 class Pipx(AbstractPackager):
-    def __init__(self, file_dir: str, file_name: str = "pipx.json") -> None:
+    restore_after = ["brew"]
+    jobs = 1
+    options = ["jobs"]
+
+    def __init__(
+        self, file_dir: str, file_name: str = "pipx.json", jobs: int = 1
+    ) -> None:
+        self.jobs = jobs
         super().__init__(
             "cat {filepath}",
             "pipx list --include-injected --json",
-            "pipx install-all {filepath}",
+            "",
             "pipx --version",
             file_dir,
             file_name,
         )
 
     def backup(self) -> None:
-        with open(self.filepath, "w") as f:
-            cmd(self.backupcmd, stdout=f)
-            self.info()
+        with self.open_backup() as f:
+            cmd_stream(self.backupcmd, tee=f)
+        self.info()
+
+    def restore(self) -> None:
+        with open(self.readpath, "r") as f:
+            saved = json.load(f).get("venvs", {})
+        installed = self._installed()
+
+        # workers share one pip cache, pip's default location unless set
+        env = dict(os.environ)
+        env.setdefault(
+            "PIP_CACHE_DIR",
+            os.path.join(
+                os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pip"
+            ),
+        )
+
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(
+                    self._restore_venv, name, venv["metadata"], installed.get(name), env
+                )
+                for name, venv in sorted(saved.items())
+            ]
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                result = future.result()
+                results.append(result)
+                print(f"[{i + 1}/{len(futures)}] {result[0]}: {result[1]}")
+
+        print("")
+        print_table(["app", "result", "version", "detail"], sorted(results))
+        failed = sorted(x[0] for x in results if x[1] == "failed")
+        if failed:
+            raise RestoreException(f"failed to restore {len(failed)} apps: {failed}")
+
+    def saved(self) -> dict[str, str]:
+        with open(self.readpath, "r") as f:
+            venvs = json.load(f).get("venvs", {})
+        return self._versions({k: v["metadata"] for k, v in venvs.items()})
+
+    def live(self) -> dict[str, str]:
+        return self._versions(self._installed())
+
+    def _versions(self, venvs: dict[str, dict]) -> dict[str, str]:
+        # apps and "app package" for each injected package
+        versions = {}
+        for name, metadata in venvs.items():
+            versions[name] = metadata["main_package"].get("package_version", "")
+            for k, v in metadata.get("injected_packages", {}).items():
+                versions[f"{name} {k}"] = v.get("package_version", "")
+        return versions
+
+    def _installed(self) -> dict[str, dict]:
+        output = cmd(self.backupcmd, verbose=False).stdout
+        venvs = json.loads(output).get("venvs", {})
+        return {k: v["metadata"] for k, v in venvs.items()}
+
+    def _restore_venv(
+        self,
+        name: str,
+        metadata: dict,
+        existing: typing.Optional[dict],
+        env: dict[str, str],
+    ) -> tuple[str, str, str, str]:
+        main = metadata["main_package"]
+        version = main.get("package_version", "")
+        try:
+            # install missing apps, reinstall ones at another version
+            result = "skipped"
+            injected: dict = {}
+            if existing:
+                injected = existing.get("injected_packages", {})
+            if (
+                not existing
+                or existing["main_package"].get("package_version") != version
+            ):
+                command = ["pipx", "install", _spec(main)]
+                if existing:
+                    command.append("--force")
+                    injected = {}
+                if main.get("suffix"):
+                    command += ["--suffix", main["suffix"]]
+                if main.get("include_dependencies"):
+                    command.append("--include-deps")
+                if main.get("pip_args"):
+                    command += ["--pip-args", shlex.join(main["pip_args"])]
+                cmd(shlex.join(command), verbose=False, env=env)
+                result = "reinstalled" if existing else "installed"
+
+            # inject whichever packages are missing or at another version
+            missing = [
+                v
+                for k, v in sorted(metadata.get("injected_packages", {}).items())
+                if injected.get(k, {}).get("package_version")
+                != v.get("package_version")
+            ]
+            if missing:
+                command = ["pipx", "inject", name] + [_spec(x) for x in missing]
+                if existing and result == "skipped":
+                    command.append("--force")
+                pip_args = [y for x in missing for y in x.get("pip_args", [])]
+                if pip_args:
+                    command += ["--pip-args", shlex.join(pip_args)]
+                cmd(shlex.join(command), verbose=False, env=env)
+                if result == "skipped":
+                    result = "injected"
+            detail = " ".join(_spec(x) for x in missing)
+            return name, result, version, detail
+        except subprocess.CalledProcessError as e:
+            lines = (e.stderr or "").strip().splitlines()
+            return name, "failed", version, lines[-1] if lines else str(e)
+
+
+def _spec(package: dict) -> str:
+    # pin index packages to the saved version, urls and paths as saved
+    source = package.get("package_or_url") or package["package"]
+    version = package.get("package_version")
+    if source == package["package"] and version:
+        return f"{source}=={version}"
+    return source
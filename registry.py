@@ -0,0 +1,152 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import typing
+
+from utils import write_atomic
+
+# dir inside the box conf for feng-shui's own state, never linked
+STATE_DIRNAME = ".feng-shui"
+REGISTRY_FILENAME = "links.jsonl"
+JOURNAL_FILENAME = "journal.jsonl"
+LOCK_FILENAME = "lock"
+
+logger = logging.getLogger(__name__)
+
+# link states reported by status
+OK = "ok"
+MISSING = "missing"
+CHANGED = "changed"
+REPLACED = "replaced"
+BROKEN = "broken"
+
+
+class Link(typing.NamedTuple):
+    target: str
+    source: str
+    backup: str = ""
+
+
+class Registry(object):
+    path = ""
+
+    def __init__(self, box_conf: str) -> None:
+        self.path = os.path.join(box_conf, STATE_DIRNAME, REGISTRY_FILENAME)
+        self.links: typing.Optional[dict[str, Link]] = None
+        self.lines = 0
+
+    def load(self) -> dict[str, Link]:
+        # replay the append only journal
+        if self.links is None:
+            self.links = {}
+            try:
+                with open(self.path, "r") as f:
+                    for line in f:
+                        self.lines += 1
+                        record = json.loads(line)
+                        if record["op"] == "add":
+                            link = Link(
+                                record["target"], record["source"], record["backup"]
+                            )
+                            self.links[link.target] = link
+                        else:
+                            self.links.pop(record["target"], None)
+            except FileNotFoundError:
+                pass
+        return self.links
+
+    def add(self, target: str, source: str, backup: str = "") -> None:
+        link = Link(target, source, backup)
+        links = self.load()
+        if links.get(target) != link:
+            links[target] = link
+            self._append({"op": "add", **link._asdict()})
+
+    def adopt(self, target: str, source: str) -> None:
+        # record an existing link without losing its backup path
+        link = self.load().get(target)
+        if not link or link.source != source:
+            self.add(target, source)
+
+    def remove(self, target: str) -> None:
+        links = self.load()
+        if target in links:
+            del links[target]
+            self._append({"op": "remove", "target": target})
+
+    def compact(self) -> None:
+        # rewrite the journal once mostly stale, only while holding the lock
+        # so no record appended by another run is lost
+        links = self.load()
+        if self.lines <= 2 * len(links) + 100:
+            return
+        self.lines = len(links)
+        write_atomic(
+            self.path,
+            "".join(
+                f"{json.dumps({'op': 'add', **x._asdict()})}\n" for x in links.values()
+            ),
+        )
+
+    def _append(self, record: dict) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(f"{json.dumps(record)}\n")
+        self.lines += 1
+
+
+class Journal(object):
+    # actions of a link run, written before any is applied and removed once
+    # all are, so a run which was interrupted can be finished or rolled back
+    path = ""
+
+    def __init__(self, box_conf: str) -> None:
+        self.path = os.path.join(box_conf, STATE_DIRNAME, JOURNAL_FILENAME)
+
+    def load(self) -> list[dict]:
+        try:
+            with open(self.path, "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def begin(self, entries: list[dict]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            f.write("".join(f"{json.dumps(x)}\n" for x in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@contextlib.contextmanager
+def lock(box_conf: str) -> typing.Iterator[None]:
+    # one run at a time changes a box's links, others wait then see its work
+    path = os.path.join(box_conf, STATE_DIRNAME, LOCK_FILENAME)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.warning('waiting for another run on "%s"', box_conf)
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def status(link: Link) -> str:
+    try:
+        target = os.readlink(link.target)
+    except FileNotFoundError:
+        return MISSING
+    except OSError:
+        return REPLACED
+    if target != link.source:
+        return CHANGED
+    if not os.path.exists(link.source):
+        return BROKEN
+    return OK
@@ -0,0 +1,63 @@
+import concurrent.futures
+import fnmatch
+import os
+
+# dirs which are never worth walking for broken links
+DEFAULT_EXCLUDES = [".cache", ".git", "node_modules"]
+
+
+def find_broken_links(
+    root: str,
+    depth: int = 0,
+    excludes: list[str] = DEFAULT_EXCLUDES,
+    one_file_system: bool = False,
+    jobs: int = 1,
+) -> list[str]:
+    # depth of 1 is only the entries of root, 0 is unlimited
+    root_dev = os.stat(root).st_dev
+
+    def scan_dir(path: str, level: int) -> tuple[list[str], list[tuple[str, int]]]:
+        links: list[str] = []
+        subdirs: list[tuple[str, int]] = []
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return links, subdirs
+        for entry in entries:
+            if any(fnmatch.fnmatch(entry.name, x) for x in excludes):
+                continue
+            if entry.is_symlink():
+                # exists follows the link relative to its own dir
+                if not os.path.exists(entry.path):
+                    links.append(entry.path)
+            elif (not depth or level < depth) and entry.is_dir(follow_symlinks=False):
+                if one_file_system and entry.stat().st_dev != root_dev:
+                    continue
+                subdirs.append((entry.path, level + 1))
+        return links, subdirs
+
+    broken = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        pending = {executor.submit(scan_dir, root, 1)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                links, subdirs = future.result()
+                broken += links
+                pending |= {executor.submit(scan_dir, *x) for x in subdirs}
+    return sorted(broken)
+
+
+def link_target(path: str) -> str:
+    return os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+
+
+def points_into(path: str, directory: str) -> bool:
+    target = link_target(path)
+    return any(
+        target == x or target.startswith(x + os.sep)
+        for x in [os.path.abspath(directory), os.path.realpath(directory)]
+    )
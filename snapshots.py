@@ -0,0 +1,224 @@
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+import zlib
+
+from registry import STATE_DIRNAME
+from utils import CACHE_DIR, file_hash, write_atomic
+
+# compressed file contents under the conf dir, named by sha256, shared by boxes
+OBJECTS_DIRNAME = "objects"
+
+# history of each box's backups, inside its state dir
+SNAPSHOTS_FILENAME = "snapshots.jsonl"
+LOCK_FILENAME = "snapshots.lock"
+
+# how many snapshots, one per backup run, each box keeps, older ones are
+# dropped on commit
+KEEP_VARNAME = "FS_SNAPSHOT_KEEP"
+DEFAULT_KEEP = 100
+
+# unreferenced objects younger than this may belong to a backup in progress,
+# or one whose snapshot has not synced from another machine yet
+GRACE_SECONDS = 24 * 60 * 60
+
+# backup files are checked out here to be read, by content
+CHECKOUT_DIR = os.path.join(CACHE_DIR, "checkout")
+
+
+# packagers back up concurrently from "package all"
+lock = threading.Lock()
+
+# snapshots made by this run, later backups of the run amend them so there
+# is one snapshot per run however many files it backs up
+made: set[str] = set()
+
+
+class SnapshotException(Exception):
+    pass
+
+
+class Snapshot(typing.NamedTuple):
+    id: str
+    parent: str
+    time: str
+    # path relative to the box conf dir mapped to object digest
+    files: dict[str, str]
+
+
+class ObjectStore(object):
+    path = ""
+
+    def __init__(self, conf_dir: str) -> None:
+        self.path = os.path.join(conf_dir, OBJECTS_DIRNAME)
+
+    def put(self, file_path: str) -> str:
+        # store a file once however many boxes back it up
+        digest = file_hash(file_path)
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            # fresh again, so collect leaves it alone until it is committed
+            os.utime(object_path)
+            return digest
+        object_dir = os.path.dirname(object_path)
+        os.makedirs(object_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=object_dir, prefix=".")
+        try:
+            compressor = zlib.compressobj(9)
+            with open(file_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                for chunk in iter(lambda: src.read(1 << 16), b""):
+                    dst.write(compressor.compress(chunk))
+                dst.write(compressor.flush())
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return digest
+
+    def checkout(self, digest: str, file_path: str) -> None:
+        # write an object out, skipped when an intact copy already exists
+        if os.path.isfile(file_path) and file_hash(file_path) == digest:
+            return
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if not os.path.isfile(self.object_path(digest)):
+            raise SnapshotException(f'object "{digest}" is missing')
+        decompressor = zlib.decompressobj()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".")
+        try:
+            with (
+                open(self.object_path(digest), "rb") as src,
+                os.fdopen(fd, "wb") as dst,
+            ):
+                for chunk in iter(lambda: src.read(1 << 16), b""):
+                    dst.write(decompressor.decompress(chunk))
+                dst.write(decompressor.flush())
+            if file_hash(temp_path) != digest:
+                raise SnapshotException(f'object "{digest}" is corrupt')
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def collect(self, referenced: set[str], grace: float = GRACE_SECONDS) -> int:
+        # remove objects no snapshot points at, returns how many
+        removed = 0
+        now = time.time()
+        for object_path in glob.glob(os.path.join(self.path, "??", "*")):
+            digest = "".join(object_path.split(os.sep)[-2:])
+            if digest in referenced:
+                continue
+            try:
+                if now - os.stat(object_path).st_mtime < grace:
+                    continue
+                os.remove(object_path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+
+class Snapshots(object):
+    path = ""
+
+    def __init__(self, box_conf: str, store: ObjectStore) -> None:
+        self.box_conf = box_conf
+        self.store = store
+        self.path = os.path.join(box_conf, STATE_DIRNAME, SNAPSHOTS_FILENAME)
+
+    def load(self) -> list[Snapshot]:
+        try:
+            with open(self.path, "r") as f:
+                return [Snapshot(**json.loads(line)) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def head(self) -> typing.Optional[Snapshot]:
+        snapshots = self.load()
+        return snapshots[-1] if snapshots else None
+
+    def commit(self, file_path: str) -> Snapshot:
+        # new snapshot of the box with file_path at its current content
+        relative = os.path.relpath(file_path, self.box_conf)
+        digest = self.store.put(file_path)
+        state_dir = os.path.dirname(self.path)
+        os.makedirs(state_dir, exist_ok=True)
+        with lock, open(os.path.join(state_dir, LOCK_FILENAME), "a") as lock_file:
+            # the head must not move between reading it and writing
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshots = self.load()
+            head = snapshots[-1] if snapshots else None
+            files = dict(head.files) if head else {}
+            if head and files.get(relative) == digest:
+                return head
+            files[relative] = digest
+            if head and head.id in made:
+                snapshot = head._replace(files=files)
+                snapshots[-1] = snapshot
+                write_atomic(self.path, "".join(_dumps(x) for x in snapshots))
+                return snapshot
+            parent = head.id if head else ""
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            record = {"parent": parent, "time": now, "files": files}
+            snapshot_id = hashlib.sha256(
+                json.dumps(record, sort_keys=True).encode()
+            ).hexdigest()[:12]
+            snapshot = Snapshot(snapshot_id, parent, now, files)
+            made.add(snapshot_id)
+            snapshots.append(snapshot)
+            keep = max(int(os.getenv(KEEP_VARNAME, DEFAULT_KEEP)), 1)
+            if len(snapshots) > keep:
+                lines = [_dumps(x) for x in snapshots[-keep:]]
+                write_atomic(self.path, "".join(lines))
+            else:
+                with open(self.path, "a") as f:
+                    f.write(_dumps(snapshot))
+        return snapshot
+
+    def find(self, snapshot_id: str) -> Snapshot:
+        found = [x for x in self.load() if x.id.startswith(snapshot_id)]
+        if len(found) != 1:
+            problem = "ambiguous" if found else "unknown"
+            raise SnapshotException(f'{problem} snapshot "{snapshot_id}"')
+        return found[0]
+
+    def checkout(self, snapshot_id: str, file_path: str, directory: str = "") -> str:
+        # file_path as of a snapshot, written under directory by content
+        snapshot = self.find(snapshot_id)
+        relative = os.path.relpath(file_path, self.box_conf)
+        if relative not in snapshot.files:
+            raise SnapshotException(f'"{relative}" not in snapshot "{snapshot.id}"')
+        digest = snapshot.files[relative]
+        checkout_path = os.path.join(
+            directory or CHECKOUT_DIR, digest, os.path.basename(file_path)
+        )
+        self.store.checkout(digest, checkout_path)
+        return checkout_path
+
+
+def collect(conf_dir: str, grace: float = GRACE_SECONDS) -> int:
+    # remove objects which no snapshot of any box points at any more
+    referenced: set[str] = set()
+    pattern = os.path.join(
+        conf_dir, "boxes", "*", "*", STATE_DIRNAME, SNAPSHOTS_FILENAME
+    )
+    store = ObjectStore(conf_dir)
+    for path in glob.glob(pattern):
+        box_conf = os.path.dirname(os.path.dirname(path))
+        for snapshot in Snapshots(box_conf, store).load():
+            referenced.update(snapshot.files.values())
+    return store.collect(referenced, grace)
+
+
+def _dumps(snapshot: Snapshot) -> str:
+    return f"{json.dumps(snapshot._asdict(), sort_keys=True)}\n"
@@ -0,0 +1,48 @@
+import os
+import stat
+import subprocess
+import sys
+import typing
+
+import pytest
+
+# modules live at the top of the repo rather than in a package
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch) -> typing.Callable[[str, str], str]:
+    # put a shell script named like a package manager first on $PATH
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def write(name: str, script: str) -> str:
+        path = bin_dir / name
+        path.write_text(f"#!/bin/sh\n{script}")
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+        return str(path)
+
+    return write
+
+
+@pytest.fixture
+def cli(tmp_path) -> typing.Callable[..., subprocess.CompletedProcess]:
+    # run cli.py for "env/box" in tmp_path/conf, with tmp_path/home as home
+    (tmp_path / "home").mkdir()
+    (tmp_path / "conf" / "boxes" / "env" / "box").mkdir(parents=True)
+    env = dict(os.environ, HOME=str(tmp_path / "home"))
+    env["XDG_CACHE_HOME"] = str(tmp_path / "cache")
+    conf = ["--conf", str(tmp_path / "conf"), "--env", "env", "--box", "box"]
+
+    def run(*args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, "cli.py"), *conf, *args],
+            env=env,
+            capture_output=True,
+            text=True,
+            stdin=subprocess.DEVNULL,
+        )
+
+    return run
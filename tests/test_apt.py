@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from packagers.apt import Apt, parse_control
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "apt")
+STATUS_PATH = os.path.join(FIXTURES, "status")
+EXTENDED_STATES_PATH = os.path.join(FIXTURES, "extended_states")
+
+
+@pytest.fixture
+def packager(tmp_path) -> Apt:
+    return Apt(
+        str(tmp_path),
+        status_path=STATUS_PATH,
+        extended_states_path=EXTENDED_STATES_PATH,
+    )
+
+
+def test_parse_control_skips_continuation_lines():
+    paragraphs = list(parse_control(STATUS_PATH))
+    assert len(paragraphs) == 9
+    assert paragraphs[0]["Description"] == "Debian package management system"
+    assert "This package" not in str(paragraphs[0])
+
+
+def test_installed_names_like_python_apt(packager):
+    installed = packager.installed()
+    # foreign arch packages get an arch suffix, "all" counts as native
+    assert sorted(installed) == [
+        "dpkg",
+        "git",
+        "git-man",
+        "half",
+        "libc6",
+        "libc6:i386",
+        "libfoo1:i386",
+        "tzdata",
+    ]
+
+
+def test_installed_auto_flags(packager):
+    installed = packager.installed()
+    assert installed["libc6"] is True
+    assert installed["libc6:i386"] is False
+    assert installed["libfoo1:i386"] is True
+    # arch independent packages are recorded under the native arch
+    assert installed["git-man"] is True
+    assert installed["git"] is False
+
+
+def test_installed_without_extended_states(tmp_path):
+    packager = Apt(
+        str(tmp_path),
+        status_path=STATUS_PATH,
+        extended_states_path=str(tmp_path / "missing"),
+    )
+    assert not any(packager.installed().values())
+
+
+def test_backup_lists_manual_packages(packager, tmp_path):
+    packager.backup()
+    assert (tmp_path / "apt.txt").read_text().split("\n") == [
+        "dpkg",
+        "git",
+        "half",
+        "libc6:i386",
+        "tzdata",
+    ]
+
+    # unchanged status files skip the scan entirely
+    packager.backup()
+    assert (tmp_path / ".apt.txt.state").exists()
+
+
+def test_restore_with_nothing_missing(packager, tmp_path, capsys):
+    (tmp_path / "apt.txt").write_text("git\nlibc6:i386\n")
+    packager.restore()
+    assert "all packages already installed" in capsys.readouterr().out
+
+
+def test_diff(packager, tmp_path, capsys):
+    (tmp_path / "apt.txt").write_text("git\nvim\n")
+    packager.diff()
+    lines = capsys.readouterr().out.split("\n")
+    assert "+ tzdata" in lines
+    assert "- vim" in lines
+    assert "+ git" not in lines
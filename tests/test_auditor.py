@@ -0,0 +1,42 @@
+import os
+
+import auditor
+
+
+def write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def make_boxes(conf_dir: str, count: int) -> None:
+    for i in range(count):
+        box_dir = os.path.join(conf_dir, "boxes", "env", f"box{i}")
+        write(os.path.join(box_dir, ".vimrc"), "set number\n")
+        write(os.path.join(box_dir, "pkg", "apt.txt"), "git\nvim\n")
+        # sidecars record per box state, so always differ
+        write(os.path.join(box_dir, "pkg", ".apt.txt.state"), f"{i}\n")
+
+
+def test_state_sidecars_are_not_manifests(tmp_path):
+    make_boxes(str(tmp_path), 3)
+    report = auditor.audit(str(tmp_path))
+    assert report["diverged_manifests"] == []
+    assert report["missing_manifests"] == []
+
+
+def test_diverged_manifests(tmp_path):
+    make_boxes(str(tmp_path), 3)
+    write(str(tmp_path / "boxes/env/box0/pkg/apt.txt"), "git\n")
+    report = auditor.audit(str(tmp_path))
+    assert report["diverged_manifests"] == [
+        {"path": "pkg/apt.txt", "variants": 2, "boxes": 3, "most_common": 2}
+    ]
+
+
+def test_near_global_leaves_out_pkg(tmp_path):
+    make_boxes(str(tmp_path), 3)
+    report = auditor.audit(str(tmp_path))
+    assert report["near_global"] == [
+        {"path": ".vimrc", "boxes": 3, "share": 1.0, "in_global": False}
+    ]
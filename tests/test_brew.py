@@ -0,0 +1,38 @@
+from packagers.brew import Brew
+
+BREWFILE = 'tap "homebrew/core"\nbrew "jq"\ncask "firefox"\n'
+
+# writes a Brewfile to the path given with --file, like brew bundle dump
+DUMP = f"""
+while [ "$#" -gt 0 ]; do
+    [ "$1" = "--file" ] && file="$2"
+    shift
+done
+printf '{BREWFILE}' > "$file"
+"""
+
+
+def test_backup_writes_brewfile(tmp_path, stub, monkeypatch):
+    stub("brew", DUMP)
+    monkeypatch.chdir(tmp_path)
+    pkg_dir = tmp_path / "pkg"
+    pkg_dir.mkdir()
+    (pkg_dir / "Brewfile").write_text('brew "old"\n')
+
+    Brew(str(pkg_dir)).backup()
+
+    assert (pkg_dir / "Brewfile").read_text() == BREWFILE
+    assert sorted(x.name for x in pkg_dir.iterdir()) == [".Brewfile.state", "Brewfile"]
+    assert list(tmp_path.glob("[0-9]*")) == []
+
+
+def test_backup_unchanged_keeps_file(tmp_path, stub):
+    stub("brew", DUMP)
+    pkg_dir = tmp_path / "pkg"
+    pkg_dir.mkdir()
+    Brew(str(pkg_dir)).backup()
+    mtime = (pkg_dir / "Brewfile").stat().st_mtime_ns
+
+    Brew(str(pkg_dir)).backup()
+
+    assert (pkg_dir / "Brewfile").stat().st_mtime_ns == mtime
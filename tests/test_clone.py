@@ -0,0 +1,38 @@
+import json
+import os
+import shutil
+
+import clone
+
+
+def make_source(conf_dir) -> str:
+    source = conf_dir / "boxes" / "env" / "src"
+    source.mkdir(parents=True)
+    (source / ".vimrc").write_text("set number\n")
+    return str(source)
+
+
+def test_lazy_sources_survive_moving_the_conf_dir(tmp_path):
+    conf_dir = tmp_path / "conf"
+    source = make_source(conf_dir)
+    destination = str(conf_dir / "boxes" / "env" / "dst")
+    clone.clone(str(conf_dir), source, destination, lazy=True, hardlink=False)
+
+    with open(os.path.join(destination, ".feng-shui", "clone.json")) as f:
+        assert json.load(f)["sources"] == ["env/src"]
+
+    moved = tmp_path / "elsewhere"
+    shutil.move(str(conf_dir), str(moved))
+    box = clone.Clone(str(moved / "boxes" / "env" / "dst"), str(moved))
+    assert box.resolve(".vimrc") == str(moved / "boxes" / "env" / "src" / ".vimrc")
+
+
+def test_clone_of_lazy_clone_keeps_its_sources(tmp_path):
+    conf_dir = tmp_path / "conf"
+    source = make_source(conf_dir)
+    lazy = str(conf_dir / "boxes" / "env" / "lazy")
+    clone.clone(str(conf_dir), source, lazy, lazy=True, hardlink=False)
+    destination = str(conf_dir / "boxes" / "other" / "dst")
+    clone.clone(str(conf_dir), lazy, destination, lazy=True, hardlink=False)
+
+    assert clone.Clone(destination, str(conf_dir)).sources() == [lazy, source]
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from packagers.dconf import Dconf
+
+# unsorted like dconf prints it, relative to the dumped dir
+DUMP_ROOT = """[org/gnome/desktop/interface]
+gtk-theme='Adwaita'
+clock-format='24h'
+
+[com/example/app]
+window-size=(800, 600)
+"""
+
+DUMP_GNOME = """[desktop/interface]
+gtk-theme='Adwaita'
+clock-format='24h'
+"""
+
+SAVED_ROOT = """[com/example/app]
+window-size=(800, 600)
+
+[org/gnome/desktop/interface]
+clock-format='24h'
+gtk-theme='Adwaita'
+
+"""
+
+
+@pytest.fixture
+def dconf(tmp_path, stub):
+    # dumps the keyfile saved for each dir, loads into loaded.dconf
+    dumps = tmp_path / "dumps"
+    dumps.mkdir()
+    (dumps / "_").write_text(DUMP_ROOT)
+    (dumps / "_org_gnome_").write_text(DUMP_GNOME)
+    stub(
+        "dconf",
+        f"""
+case "$1" in
+    dump) cat "{dumps}/$(echo "$2" | tr / _)" ;;
+    load) cat > "{tmp_path}/loaded.dconf" ;;
+esac
+""",
+    )
+    return tmp_path
+
+
+def test_backup_sorts_dirs_and_keys(dconf, monkeypatch):
+    monkeypatch.delenv("FS_DCONF_SUBTREES", raising=False)
+    Dconf(str(dconf)).backup()
+    assert (dconf / "settings.dconf").read_text() == SAVED_ROOT
+
+
+def test_backup_subtrees_are_absolute(dconf):
+    Dconf(str(dconf), subtrees=["org/gnome"]).backup()
+    assert (dconf / "settings.dconf").read_text() == (
+        "[org/gnome/desktop/interface]\nclock-format='24h'\ngtk-theme='Adwaita'\n\n"
+    )
+
+
+def test_restore_loads_changed_keys(dconf, capsys):
+    (dconf / "settings.dconf").write_text(
+        "[org/gnome/desktop/interface]\nclock-format='12h'\ngtk-theme='Adwaita'\n"
+        "\n[org/other]\nkey=1\n"
+    )
+    Dconf(str(dconf), subtrees=["/org/gnome/"]).restore()
+
+    assert "loading 1 changed keys" in capsys.readouterr().out
+    assert (dconf / "loaded.dconf").read_text() == (
+        "[org/gnome/desktop/interface]\nclock-format='12h'\n\n"
+    )
+
+
+def test_restore_with_nothing_changed(dconf, capsys):
+    (dconf / "settings.dconf").write_text(SAVED_ROOT)
+    Dconf(str(dconf), subtrees=["/"]).restore()
+
+    assert "all settings already match" in capsys.readouterr().out
+    assert not (dconf / "loaded.dconf").exists()
+
+
+def test_json_diff_prints_only_json(dconf, capsys):
+    (dconf / "settings.dconf").write_text(SAVED_ROOT.replace("24h", "12h"))
+    packager = Dconf(str(dconf), subtrees=["/"])
+    packager.verbose = False
+    packager.json_output = True
+    packager.diff()
+
+    changes = json.loads(capsys.readouterr().out)
+    assert changes["changed"] == {
+        "/org/gnome/desktop/interface/clock-format": ["'12h'", "'24h'"]
+    }
@@ -0,0 +1,158 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from packagers.exceptions import RestoreException
+from packagers.git import Git
+
+
+def git(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args], check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def remotes(tmp_path, monkeypatch):
+    # local bare repos stand in for the real remotes
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    found = {}
+    for name in ["alpha", "beta"]:
+        work = tmp_path / "work" / name
+        git("init", "-q", str(work))
+        (work / "README").write_text(f"{name}\n")
+        git("-C", str(work), "add", "README")
+        git(
+            "-C",
+            str(work),
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@example.com",
+            "commit",
+            "-qm",
+            "init",
+        )
+        bare = tmp_path / "remotes" / f"{name}.git"
+        git("clone", "-q", "--bare", str(work), str(bare))
+        found[name] = str(bare)
+    return found
+
+
+def write_backup(pkg_dir, repos: dict[str, dict]) -> None:
+    os.makedirs(pkg_dir, exist_ok=True)
+    (pkg_dir / "git_repos.json").write_text(json.dumps(repos))
+
+
+def test_restore_clones_and_sets_remotes(tmp_path, remotes, capsys):
+    pkg_dir = tmp_path / "pkg"
+    install_dir = tmp_path / "projects"
+    write_backup(
+        pkg_dir,
+        {
+            "alpha": {"remotes": {"origin": remotes["alpha"]}},
+            "beta": {
+                "remotes": {"origin": remotes["beta"], "upstream": remotes["alpha"]}
+            },
+        },
+    )
+    Git(str(pkg_dir), install_dir=str(install_dir), jobs=2).restore()
+
+    assert (install_dir / "alpha" / "README").read_text() == "alpha\n"
+    beta = str(install_dir / "beta")
+    assert git("-C", beta, "remote", "get-url", "upstream") == remotes["alpha"]
+    assert "cloned" in capsys.readouterr().out
+
+
+def test_restore_skips_matching_and_fixes_changed_remotes(tmp_path, remotes, capsys):
+    pkg_dir = tmp_path / "pkg"
+    install_dir = tmp_path / "projects"
+    git("clone", "-q", remotes["alpha"], str(install_dir / "alpha"))
+    git("clone", "-q", remotes["alpha"], str(install_dir / "beta"))
+    write_backup(
+        pkg_dir,
+        {
+            "alpha": {"remotes": {"origin": remotes["alpha"]}},
+            "beta": {"remotes": {"origin": remotes["beta"]}},
+        },
+    )
+    Git(str(pkg_dir), install_dir=str(install_dir)).restore()
+
+    out = capsys.readouterr().out
+    assert "alpha: skipped" in out
+    assert "beta: updated" in out
+    beta = str(install_dir / "beta")
+    assert git("-C", beta, "remote", "get-url", "origin") == remotes["beta"]
+
+
+def test_restore_reports_failures(tmp_path, remotes):
+    pkg_dir = tmp_path / "pkg"
+    write_backup(
+        pkg_dir,
+        {
+            "alpha": {"remotes": {"origin": remotes["alpha"]}},
+            "gone": {"remotes": {"origin": str(tmp_path / "missing.git")}},
+        },
+    )
+    git_packager = Git(str(pkg_dir), install_dir=str(tmp_path / "projects"))
+    with pytest.raises(RestoreException, match="gone"):
+        git_packager.restore()
+    assert (tmp_path / "projects" / "alpha" / "README").exists()
+
+
+def test_restore_shallow_clone(tmp_path, remotes):
+    pkg_dir = tmp_path / "pkg"
+    install_dir = tmp_path / "projects"
+    write_backup(
+        pkg_dir, {"alpha": {"remotes": {"origin": f"file://{remotes['alpha']}"}}}
+    )
+    Git(str(pkg_dir), install_dir=str(install_dir), depth=1).restore()
+    alpha = str(install_dir / "alpha")
+    assert git("-C", alpha, "rev-parse", "--is-shallow-repository") == "true"
+
+
+def test_backup_sees_remote_changes_in_worktrees(tmp_path, remotes):
+    # a linked worktree's remotes live in the main repo's config
+    main = tmp_path / "main"
+    git("clone", "-q", remotes["alpha"], str(main))
+    install_dir = tmp_path / "projects"
+    git("-C", str(main), "worktree", "add", "-q", str(install_dir / "wt"))
+    packager = Git(str(tmp_path / "pkg"), install_dir=str(install_dir))
+    os.makedirs(tmp_path / "pkg")
+    packager.backup()
+
+    # a url of another length, mtimes can be too coarse to tell apart
+    url = f"file://{remotes['beta']}"
+    git("-C", str(main), "remote", "set-url", "origin", url)
+    packager.backup()
+
+    saved = json.loads((tmp_path / "pkg" / "git_repos.json").read_text())
+    assert saved["wt"]["remotes"]["origin"] == url
+
+
+def test_fingerprint_follows_includes(tmp_path, remotes):
+    install_dir = tmp_path / "projects"
+    repo = install_dir / "alpha"
+    git("clone", "-q", remotes["alpha"], str(repo))
+    included = tmp_path / "remotes.inc"
+    included.write_text(f'[remote "mirror"]\n\turl = {remotes["alpha"]}\n')
+    git("-C", str(repo), "config", "include.path", str(included))
+    packager = Git(str(tmp_path / "pkg"), install_dir=str(install_dir))
+    before = packager.fingerprint()
+
+    included.write_text(f'[remote "mirror"]\n\turl = file://{remotes["beta"]}\n')
+
+    assert before and packager.fingerprint() != before
+
+
+def test_query_remotes_quiet_unless_verbose(tmp_path, remotes, capsys):
+    repo = tmp_path / "projects" / "alpha"
+    git("clone", "-q", remotes["alpha"], str(repo))
+    packager = Git(str(tmp_path / "pkg"), install_dir=str(tmp_path / "projects"))
+    packager.verbose = False
+
+    assert packager._query_remotes(str(repo)) == {"origin": remotes["alpha"]}
+    assert capsys.readouterr().out == ""
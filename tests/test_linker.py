@@ -0,0 +1,256 @@
+import os
+
+import pytest
+
+import linker
+
+
+def write(path, content: str = "") -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_names_limit_nested_paths(tmp_path):
+    # .config is a real dir in home, so its entries are linked one by one
+    conf_dir = str(tmp_path / "conf")
+    home_dir = str(tmp_path / "home")
+    write(os.path.join(conf_dir, ".vimrc"))
+    write(os.path.join(conf_dir, ".config/git/config"))
+    write(os.path.join(conf_dir, ".config/fish/config.fish"))
+    os.makedirs(os.path.join(home_dir, ".config"))
+
+    actions = linker.plan([conf_dir], home_dir, False, {".config/git/config"})
+
+    assert [(x.kind, x.target) for x in actions] == [
+        (linker.CREATE, os.path.join(home_dir, ".config/git"))
+    ]
+
+
+def test_visited_dirs(tmp_path):
+    conf_dir = str(tmp_path / "conf")
+    home_dir = str(tmp_path / "home")
+    write(os.path.join(conf_dir, ".config/git/config"))
+    write(os.path.join(conf_dir, ".ssh/config"))
+    os.makedirs(os.path.join(home_dir, ".config"))
+
+    visited: set[str] = set()
+    linker.plan([conf_dir], home_dir, False, visited=visited)
+
+    assert visited == {
+        conf_dir,
+        home_dir,
+        os.path.join(conf_dir, ".config"),
+        os.path.join(home_dir, ".config"),
+    }
+
+
+def test_matches():
+    assert linker.matches(".config", {".config/git/config"})
+    assert linker.matches(".config/git/config", {".config/git"})
+    assert not linker.matches(".config/fish", {".config/git"})
+    assert not linker.matches(".conf", {".config"})
+
+
+def crash_on_link(monkeypatch, count: int) -> None:
+    # symlinks after the first count - 1 fail as if the run was killed
+    symlink = os.symlink
+    calls = []
+
+    def fake_symlink(source, target):
+        calls.append(target)
+        if len(calls) >= count:
+            raise KeyboardInterrupt
+        symlink(source, target)
+
+    monkeypatch.setattr(os, "symlink", fake_symlink)
+
+
+def backed_up_home(tmp_path):
+    conf_dir = str(tmp_path / "conf")
+    home_dir = str(tmp_path / "home")
+    for name in ["a", "b", "c"]:
+        write(os.path.join(conf_dir, name), "conf")
+        write(os.path.join(home_dir, name), "home")
+    actions = linker.plan([conf_dir], home_dir, True)
+    assert [x.kind for x in actions] == [linker.BACKUP] * 3
+    return home_dir, actions
+
+
+def interrupted(tmp_path, monkeypatch):
+    home_dir, actions = backed_up_home(tmp_path)
+    journal = linker.Journal(str(tmp_path))
+    links = linker.Registry(str(tmp_path))
+    with monkeypatch.context() as m:
+        crash_on_link(m, 3)
+        try:
+            linker.apply(actions, links, journal)
+        except KeyboardInterrupt:
+            pass
+    return home_dir, journal, links
+
+
+def test_journal_begin_finish(tmp_path):
+    journal = linker.Journal(str(tmp_path))
+    assert journal.load() == []
+
+    journal.begin([{"target": "a"}, {"target": "b"}])
+    assert journal.load() == [{"target": "a"}, {"target": "b"}]
+
+    journal.finish()
+    assert journal.load() == []
+
+
+def test_apply_finishes_journal(tmp_path):
+    _, actions = backed_up_home(tmp_path)
+    journal = linker.Journal(str(tmp_path))
+
+    linker.apply(actions, linker.Registry(str(tmp_path)), journal)
+
+    assert journal.load() == []
+
+
+def test_recover_records_made_links(tmp_path, monkeypatch):
+    home_dir, journal, _ = interrupted(tmp_path, monkeypatch)
+    assert len(journal.load()) == 3
+
+    links = linker.Registry(str(tmp_path))
+    assert linker.recover(journal, links) == 3
+
+    made = sorted(x for x in "abc" if os.path.islink(os.path.join(home_dir, x)))
+    assert len(made) == 2
+    assert sorted(links.load()) == [os.path.join(home_dir, x) for x in made]
+    assert sorted(os.listdir(home_dir)) == sorted(
+        ["a", "b", "c"] + [f"{x}.bk" for x in made]
+    )
+    assert journal.load() == []
+
+
+def test_rollback_restores_and_drops_backups(tmp_path, monkeypatch):
+    home_dir, journal, _ = interrupted(tmp_path, monkeypatch)
+
+    links = linker.Registry(str(tmp_path))
+    assert linker.rollback(journal, links) == 3
+
+    assert links.load() == {}
+    assert sorted(os.listdir(home_dir)) == ["a", "b", "c"]
+    for name in ["a", "b", "c"]:
+        path = os.path.join(home_dir, name)
+        assert not os.path.islink(path)
+        with open(path) as f:
+            assert f.read() == "home"
+    assert journal.load() == []
+
+
+def test_backup_never_overwritten(tmp_path):
+    home_dir, actions = backed_up_home(tmp_path)
+    write(os.path.join(home_dir, "a.bk"), "older")
+
+    linker.apply(actions)
+
+    with open(os.path.join(home_dir, "a.bk")) as f:
+        assert f.read() == "older"
+    with open(os.path.join(home_dir, "a.1.bk")) as f:
+        assert f.read() == "home"
+
+
+def test_keep_refuses_existing_backup(tmp_path):
+    write(str(tmp_path / "a"), "new")
+    write(str(tmp_path / "a.bk"), "old")
+
+    with pytest.raises(FileExistsError):
+        linker._keep(str(tmp_path / "a"), str(tmp_path / "a.bk"))
+
+    assert (tmp_path / "a.bk").read_text() == "old"
+
+
+def indexed_run(box_conf, conf_dir, home_dir, monkeypatch):
+    # a link run with the index, returning its actions and the dirs it listed
+    scanned = []
+    scan = linker.scan
+
+    def fake_scan(directory):
+        scanned.append(directory)
+        return scan(directory)
+
+    index = linker.Index(box_conf, [conf_dir], home_dir)
+    index.load()
+    with monkeypatch.context() as m:
+        m.setattr(linker, "scan", fake_scan)
+        actions = linker.plan([conf_dir], home_dir, False, index=index)
+    linker.apply(actions)
+    index.save(actions)
+    return [(x.kind, x.target) for x in actions], scanned
+
+
+@pytest.fixture
+def indexed(tmp_path, monkeypatch):
+    conf_dir = str(tmp_path / "conf")
+    home_dir = str(tmp_path / "home")
+    write(os.path.join(conf_dir, ".vimrc"))
+    write(os.path.join(conf_dir, ".config/git/config"))
+    os.makedirs(os.path.join(home_dir, ".config"))
+    indexed_run(str(tmp_path), conf_dir, home_dir, monkeypatch)
+
+    def run():
+        return indexed_run(str(tmp_path), conf_dir, home_dir, monkeypatch)
+
+    return conf_dir, home_dir, run
+
+
+def test_index_skips_unchanged_tree(indexed):
+    _, _, run = indexed
+
+    assert run() == ([], [])
+
+
+def test_index_added_source(indexed):
+    conf_dir, home_dir, run = indexed
+    write(os.path.join(conf_dir, ".config/fish/config.fish"))
+
+    actions, scanned = run()
+
+    assert sorted(actions) == [
+        (linker.CREATE, os.path.join(home_dir, ".config/fish")),
+        (linker.SKIP, os.path.join(home_dir, ".config/git")),
+    ]
+    assert os.path.join(conf_dir, ".config") in scanned
+    assert conf_dir not in scanned
+    assert run() == ([], [])
+
+
+def test_index_removed_source(indexed):
+    conf_dir, home_dir, run = indexed
+    os.remove(os.path.join(conf_dir, ".vimrc"))
+
+    actions, scanned = run()
+
+    assert actions == []
+    assert scanned == [conf_dir, home_dir]
+
+
+def test_index_changed_source(indexed):
+    # a file which became a dir is merged with the dir already in home
+    conf_dir, home_dir, run = indexed
+    os.remove(os.path.join(conf_dir, ".vimrc"))
+    write(os.path.join(conf_dir, ".vimrc/vimrc"))
+    os.remove(os.path.join(home_dir, ".vimrc"))
+    os.makedirs(os.path.join(home_dir, ".vimrc"))
+
+    actions, _ = run()
+
+    assert actions == [(linker.CREATE, os.path.join(home_dir, ".vimrc/vimrc"))]
+
+
+def test_index_stale(tmp_path):
+    conf_dir = str(tmp_path / "conf")
+    home_dir = str(tmp_path / "home")
+    write(os.path.join(conf_dir, ".config/git/config"))
+    os.makedirs(os.path.join(home_dir, ".config"))
+    index = linker.Index(str(tmp_path), [conf_dir], home_dir)
+    linker.plan([conf_dir], home_dir, False, index=index)
+    assert not index.stale()
+
+    write(os.path.join(home_dir, ".config/fish/config.fish"))
+
+    assert index.stale()
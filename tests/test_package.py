@@ -0,0 +1,20 @@
+import snapshots
+
+
+def test_all_checks_at_before_running(cli):
+    result = cli("package", "all", "diff", "--at", "abc")
+    assert result.returncode == 1
+    assert 'unknown snapshot "abc"' in result.stdout
+
+    result = cli("package", "all", "backup", "--at", "abc")
+    assert result.returncode == 1
+    assert "--at only applies to" in result.stdout
+
+
+def test_gc_removes_only_old_unreferenced_objects(tmp_path, cli):
+    store = snapshots.ObjectStore(str(tmp_path / "conf"))
+    (tmp_path / "file").write_text("content\n")
+    store.put(str(tmp_path / "file"))
+
+    assert "removed 0 unreferenced objects" in cli("gc").stdout
+    assert "removed 1 unreferenced objects" in cli("gc", "--min-age", "0").stdout
@@ -0,0 +1,36 @@
+import json
+
+import registry
+
+
+def records(box_conf) -> list[dict]:
+    path = box_conf / registry.STATE_DIRNAME / registry.REGISTRY_FILENAME
+    return [json.loads(x) for x in path.read_text().splitlines()]
+
+
+def test_load_never_rewrites(tmp_path):
+    links = registry.Registry(str(tmp_path))
+    for _ in range(100):
+        links.add("/home/a", "/conf/a")
+        links.remove("/home/a")
+    before = records(tmp_path)
+
+    assert registry.Registry(str(tmp_path)).load() == {}
+    assert records(tmp_path) == before
+
+
+def test_compact_once_mostly_stale(tmp_path):
+    links = registry.Registry(str(tmp_path))
+    links.add("/home/b", "/conf/b")
+    links.compact()
+    assert len(records(tmp_path)) == 1
+
+    for _ in range(100):
+        links.add("/home/a", "/conf/a")
+        links.remove("/home/a")
+    links = registry.Registry(str(tmp_path))
+    links.compact()
+
+    assert records(tmp_path) == [
+        {"op": "add", "target": "/home/b", "source": "/conf/b", "backup": ""}
+    ]
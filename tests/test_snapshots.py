@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+import snapshots
+from packagers.brew import Brew
+
+DUMP = """
+while [ "$#" -gt 0 ]; do
+    [ "$1" = "--file" ] && file="$2"
+    shift
+done
+cat "$BREWFILE" > "$file"
+"""
+
+
+@pytest.fixture
+def box(tmp_path, stub, monkeypatch):
+    # a box whose brew backups are recorded in the conf dir's object store
+    stub("brew", DUMP)
+    monkeypatch.setattr(snapshots, "CHECKOUT_DIR", str(tmp_path / "checkout"))
+    monkeypatch.setattr(snapshots, "made", set())
+    monkeypatch.setenv("BREWFILE", str(tmp_path / "Brewfile"))
+    box_conf = tmp_path / "conf" / "boxes" / "env" / "box"
+    (box_conf / "pkg").mkdir(parents=True)
+    return box_conf
+
+
+def backup(box_conf, content: str) -> Brew:
+    # each call stands for a separate run
+    snapshots.made.clear()
+    (box_conf.parents[3] / "Brewfile").write_text(content)
+    packager = Brew(str(box_conf / "pkg"))
+    store = snapshots.ObjectStore(str(box_conf.parents[2]))
+    packager.snapshots = snapshots.Snapshots(str(box_conf), store)
+    packager.backup()
+    return packager
+
+
+def test_backup_keeps_file_and_records_object(box):
+    packager = backup(box, 'brew "jq"\n')
+
+    assert (box / "pkg" / "Brewfile").read_text() == 'brew "jq"\n'
+    (snapshot,) = packager.snapshots.load()
+    digest = snapshot.files["pkg/Brewfile"]
+    assert os.path.isfile(packager.snapshots.store.object_path(digest))
+
+
+def test_backup_unchanged_adds_no_snapshot(box, capsys):
+    backup(box, 'brew "jq"\n')
+    packager = backup(box, 'brew "jq"\n')
+
+    assert "no changes" in capsys.readouterr().out
+    assert len(packager.snapshots.load()) == 1
+
+
+def test_checkout_earlier_snapshot(box):
+    backup(box, 'brew "old"\n')
+    packager = backup(box, 'brew "jq"\n')
+
+    first = packager.snapshots.load()[0]
+    with open(packager.snapshots.checkout(first.id, packager.filepath)) as f:
+        assert f.read() == 'brew "old"\n'
+
+
+def test_old_snapshots_and_objects_are_dropped(box, monkeypatch):
+    monkeypatch.setenv(snapshots.KEEP_VARNAME, "2")
+    for name in ["a", "b", "c"]:
+        packager = backup(box, f'brew "{name}"\n')
+    conf_dir = str(box.parents[2])
+
+    assert len(packager.snapshots.load()) == 2
+    assert snapshots.collect(conf_dir) == 0
+    assert snapshots.collect(conf_dir, grace=0) == 1
+    with open(packager.readpath) as f:
+        assert f.read() == 'brew "c"\n'
+
+
+def test_one_snapshot_per_run(box):
+    store = snapshots.ObjectStore(str(box.parents[2]))
+    history = snapshots.Snapshots(str(box), store)
+    for name in ["Brewfile", "npm.json"]:
+        (box / "pkg" / name).write_text(f"{name}\n")
+        history.commit(str(box / "pkg" / name))
+
+    (snapshot,) = history.load()
+    assert sorted(snapshot.files) == ["pkg/Brewfile", "pkg/npm.json"]
+
+
+def test_put_refreshes_existing_objects(tmp_path):
+    store = snapshots.ObjectStore(str(tmp_path))
+    (tmp_path / "file").write_text("content\n")
+    digest = store.put(str(tmp_path / "file"))
+    old = time.time() - 2 * snapshots.GRACE_SECONDS
+    os.utime(store.object_path(digest), (old, old))
+
+    store.put(str(tmp_path / "file"))
+
+    assert store.collect(set()) == 0
@@ -0,0 +1,48 @@
+import os
+
+import registry
+
+
+def test_store_nested_path(tmp_path, cli):
+    home_dir = tmp_path / "home"
+    box_conf = tmp_path / "conf" / "boxes" / "env" / "box"
+    (home_dir / ".local" / "notes").mkdir(parents=True)
+    (home_dir / ".local" / "notes" / "todo").write_text("stored\n")
+
+    result = cli("store", str(home_dir / ".local" / "notes"))
+
+    assert result.returncode == 0, result.stderr
+    link = home_dir / ".local" / "notes"
+    assert os.readlink(link) == str(box_conf / ".local" / "notes")
+    assert (link / "todo").read_text() == "stored\n"
+    assert "already linked" in cli("link", "--dry-run").stdout
+
+
+def test_store_leaves_other_entries(tmp_path, cli):
+    home_dir = tmp_path / "home"
+    (home_dir / "notes").mkdir()
+    (home_dir / "notes" / "keep").write_text("unrelated\n")
+    (home_dir / ".local" / "notes").mkdir(parents=True)
+
+    result = cli("store", str(home_dir / ".local" / "notes"))
+
+    assert result.returncode == 0, result.stderr
+    assert not os.path.islink(home_dir / "notes")
+    assert (home_dir / "notes" / "keep").read_text() == "unrelated\n"
+
+
+def test_unlink_defaults_to_home_links(tmp_path, cli):
+    home_dir = tmp_path / "home"
+    box_conf = tmp_path / "conf" / "boxes" / "env" / "box"
+    (home_dir / "notes").mkdir()
+    assert cli("store", str(home_dir / "notes")).returncode == 0
+    other = registry.Registry(str(box_conf))
+    other.add(str(tmp_path / "other-home" / "notes"), str(box_conf / "notes"))
+
+    result = cli("unlink", "-f")
+
+    assert result.returncode == 0, result.stderr
+    assert str(tmp_path / "other-home" / "notes") not in result.stdout
+    assert list(registry.Registry(str(box_conf)).load()) == [
+        str(tmp_path / "other-home" / "notes")
+    ]
@@ -0,0 +1,25 @@
+import pytest
+
+import timings
+
+
+@pytest.fixture(autouse=True)
+def spans(monkeypatch):
+    monkeypatch.setattr(timings, "spans", [])
+    return timings.spans
+
+
+def test_nothing_recorded_when_disabled(spans):
+    with timings.phase("relink"):
+        pass
+    assert spans == []
+
+
+def test_phases_recorded_when_enabled(monkeypatch, spans):
+    monkeypatch.setattr(timings, "enabled", True)
+    with timings.phase("relink", actions=2):
+        pass
+    assert [(x.name, x.category, x.args) for x in spans] == [
+        ("relink", timings.PHASE, {"actions": 2})
+    ]
+    assert timings.rows()[0][4] == "relink"
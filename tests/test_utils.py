@@ -0,0 +1,36 @@
+import subprocess
+
+import pytest
+
+from utils import stream
+
+
+def test_stream_yields_lines():
+    assert list(stream("printf 'a\\nb\\nc'")) == ["a\n", "b\n", "c"]
+
+
+def test_stream_splits_long_lines():
+    # 1 MB without a newline comes out in bounded pieces
+    lines = list(stream("head -c 1048576 /dev/zero", max_buffer=1024))
+    assert "".join(lines) == "\0" * 1048576
+    assert len(lines) > 1
+    assert max(len(x) for x in lines) < 1024 + (1 << 16)
+
+
+def test_stream_joins_lines_split_across_reads():
+    command = "sh -c 'printf abc; sleep 0.05; printf \"def\\nghi\"'"
+    assert list(stream(command)) == ["abcdef\n", "ghi"]
+
+
+def test_stream_input_and_error_tail():
+    assert list(stream("cat", input="x\ny\n")) == ["x\n", "y\n"]
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        list(stream("sh -c 'echo out; echo err >&2; exit 3'"))
+    assert e.value.returncode == 3
+    assert e.value.stdout == "out\n"
+    assert e.value.stderr == "err\n"
+
+
+def test_stream_timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        list(stream("sleep 5", timeout=0.1))
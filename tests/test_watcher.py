@@ -0,0 +1,21 @@
+import watcher
+
+
+def watched(dir_watcher: watcher.Watcher) -> set[str]:
+    return {x for x, _ in dir_watcher.watches.values()}
+
+
+def test_watch_adds_and_replaces_dirs(tmp_path):
+    for name in ["a", "b", "c"]:
+        (tmp_path / name).mkdir()
+    dir_watcher = watcher.Watcher([str(tmp_path / "a")], lambda x: None)
+    try:
+        dir_watcher.watch([str(tmp_path / "b"), str(tmp_path / "missing")])
+        assert watched(dir_watcher) == {str(tmp_path / "a"), str(tmp_path / "b")}
+        assert dir_watcher.missing == [str(tmp_path / "missing")]
+
+        dir_watcher.watch([str(tmp_path / "c")], replace=True)
+        assert watched(dir_watcher) == {str(tmp_path / "c")}
+        assert dir_watcher.missing == []
+    finally:
+        dir_watcher.inotify.close()
@@ -0,0 +1,106 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import typing
+
+PHASE = "phase"
+SUBPROCESS = "subprocess"
+HEADERS = ["type", "start ms", "wall ms", "cpu ms", "name", "details"]
+
+
+class Span(typing.NamedTuple):
+    name: str
+    category: str
+    start: float
+    wall: float
+    cpu: float
+    thread: int
+    args: dict
+
+
+spans: list[Span] = []
+lock = threading.Lock()
+
+# off unless timings are printed or traced, so long runs like watch don't grow
+# spans without end
+enabled = False
+
+# perf_counter is relative, keep the epoch it was started at for traces
+origin = time.perf_counter()
+origin_epoch = time.time()
+
+
+def record(
+    name: str,
+    category: str,
+    start: float,
+    wall: float,
+    cpu: float = 0.0,
+    args: typing.Optional[dict] = None,
+) -> None:
+    if not enabled:
+        return
+    span = Span(name, category, start, wall, cpu, threading.get_ident(), args or {})
+    with lock:
+        spans.append(span)
+
+
+@contextlib.contextmanager
+def phase(name: str, **args: typing.Any) -> typing.Iterator[dict]:
+    # callers may add details to the yielded args while the phase runs
+    start = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield args
+    finally:
+        wall = time.perf_counter() - start
+        record(name, PHASE, start, wall, time.process_time() - cpu, args)
+
+
+def rows() -> list[tuple]:
+    with lock:
+        ordered = sorted(spans, key=lambda x: x.start)
+    result = []
+    for span in ordered:
+        details = " ".join(f"{k}={v}" for k, v in span.args.items())
+        cpu = f"{span.cpu * 1000:.1f}" if span.category == PHASE else ""
+        result.append(
+            (
+                span.category,
+                f"{(span.start - origin) * 1000:.1f}",
+                f"{span.wall * 1000:.1f}",
+                cpu,
+                span.name,
+                details,
+            )
+        )
+    return result
+
+
+def write_trace(path: str) -> None:
+    # json lines for ".jsonl" files, chrome trace format otherwise
+    with lock:
+        ordered = sorted(spans, key=lambda x: x.start)
+    with open(path, "w") as f:
+        if path.endswith(".jsonl"):
+            for span in ordered:
+                record = span._asdict()
+                record["start"] = origin_epoch + span.start - origin
+                f.write(f"{json.dumps(record)}\n")
+            return
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": int((span.start - origin) * 1e6),
+                "dur": int(span.wall * 1e6),
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": dict(span.args, cpu_ms=round(span.cpu * 1000, 3)),
+            }
+            for span in ordered
+        ]
+        f.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
@@ -1,7 +1,25 @@
+import codecs
+import collections
+import hashlib
+import os
+import selectors
 import shlex
 import subprocess
+import tempfile
+import threading
+import time
 import typing
 
+import timings
+
+# characters of output kept in memory for error reporting when streaming
+MAX_BUFFER = 64 * 1024
+
+# per user files which can be rebuilt at any time
+CACHE_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "feng-shui"
+)
+
 
 def cmd(
     raw_command: str,
@@ -9,6 +27,7 @@ def cmd(
     stderr: typing.Any = subprocess.PIPE,
     input: typing.Union[str, None] = None,
     verbose: bool = True,
+    env: typing.Optional[dict[str, str]] = None,
 ) -> subprocess.CompletedProcess:
     def vprint(string: str) -> None:
         if verbose:
@@ -16,6 +35,10 @@ def cmd(
 
     vprint(f"$ {raw_command}")
     command = shlex.split(raw_command)
+    offsets = [_offset(stdout), _offset(stderr)]
+    returncode: typing.Optional[int] = None
+    output: list[typing.Optional[str]] = [None, None]
+    start = time.perf_counter()
     try:
         result = subprocess.run(
             command,
@@ -23,15 +46,179 @@ def cmd(
             stderr=stderr,
             input=input,
             encoding="utf-8",
+            env=env,
             check=True,  # exception on non-zero code
         )
+        returncode, output = result.returncode, [result.stdout, result.stderr]
     except subprocess.CalledProcessError as e:
+        returncode, output = e.returncode, [e.stdout, e.stderr]
         vprint(e.stderr)
         raise e
+    finally:
+        details = {
+            "exit": returncode,
+            "stdout_bytes": _size(stdout, output[0], offsets[0]),
+            "stderr_bytes": _size(stderr, output[1], offsets[1]),
+        }
+        wall = time.perf_counter() - start
+        timings.record(raw_command, timings.SUBPROCESS, start, wall, args=details)
     vprint(result.stdout)
     return result
 
 
+def stream(
+    raw_command: str,
+    input: typing.Union[str, None] = None,
+    timeout: typing.Union[float, None] = None,
+    max_buffer: int = MAX_BUFFER,
+) -> typing.Iterator[str]:
+    # yield stdout lines as they arrive, keeping only a tail of each stream,
+    # lines longer than max_buffer come out in pieces of at least that size
+    command = shlex.split(raw_command)
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if input is not None:
+        threading.Thread(target=_feed, args=(process.stdin, input), daemon=True).start()
+    tails = {"stdout": _Tail(max_buffer), "stderr": _Tail(max_buffer)}
+    decoders = {x: codecs.getincrementaldecoder("utf-8")("replace") for x in tails}
+    pending: dict[str, list[str]] = {x: [] for x in tails}
+    pending_size = {x: 0 for x in tails}
+    details: dict[str, typing.Any] = {"exit": None, "stdout_bytes": 0}
+    details["stderr_bytes"] = 0
+    start = time.perf_counter()
+    deadline = start + timeout if timeout is not None else None
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ, "stdout")  # type: ignore
+    selector.register(process.stderr, selectors.EVENT_READ, "stderr")  # type: ignore
+    try:
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    process.kill()
+                    raise subprocess.TimeoutExpired(
+                        command,
+                        timeout or 0,
+                        str(tails["stdout"]),
+                        str(tails["stderr"]),
+                    )
+            for key, _ in selector.select(remaining):
+                name = key.data
+                chunk = os.read(key.fd, 1 << 16)
+                details[f"{name}_bytes"] += len(chunk)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                text = decoders[name].decode(chunk, final=not chunk)
+                lines = text.splitlines(keepends=True)
+                partial = ""
+                if chunk and lines and not lines[-1].endswith("\n"):
+                    partial = lines.pop()
+                if pending[name] and (lines or not chunk):
+                    # the line carried over ends here, or the stream does
+                    lines[:1] = ["".join(pending[name]) + "".join(lines[:1])]
+                    pending[name], pending_size[name] = [], 0
+                if partial:
+                    pending[name].append(partial)
+                    pending_size[name] += len(partial)
+                    if pending_size[name] >= max_buffer:
+                        lines.append("".join(pending[name]))
+                        pending[name], pending_size[name] = [], 0
+                for line in lines:
+                    tails[name].append(line)
+                    if name == "stdout":
+                        yield line
+        details["exit"] = process.wait()
+    finally:
+        selector.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for pipe in [process.stdout, process.stderr]:
+            if pipe:
+                pipe.close()
+        wall = time.perf_counter() - start
+        timings.record(raw_command, timings.SUBPROCESS, start, wall, args=details)
+    if details["exit"]:
+        raise subprocess.CalledProcessError(
+            details["exit"], command, str(tails["stdout"]), str(tails["stderr"])
+        )
+
+
+def cmd_stream(
+    raw_command: str,
+    tee: typing.Optional[typing.TextIO] = None,
+    callback: typing.Optional[typing.Callable[[str], None]] = None,
+    input: typing.Union[str, None] = None,
+    timeout: typing.Union[float, None] = None,
+    max_buffer: int = MAX_BUFFER,
+    verbose: bool = True,
+) -> subprocess.CompletedProcess:
+    # like cmd, but output goes to tee/callback as it arrives, not to memory
+    if verbose:
+        print(f"$ {raw_command}")
+    tail = _Tail(max_buffer)
+    try:
+        for line in stream(raw_command, input, timeout, max_buffer):
+            tail.append(line)
+            if tee:
+                tee.write(line)
+            if callback:
+                callback(line)
+    except subprocess.CalledProcessError as e:
+        if verbose:
+            print(e.stderr)
+        raise e
+    return subprocess.CompletedProcess(shlex.split(raw_command), 0, str(tail))
+
+
+class _Tail(object):
+    # bounded buffer of the most recent lines
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.lines: collections.deque[str] = collections.deque()
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_size and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+
+    def __str__(self) -> str:
+        return "".join(self.lines)[-self.max_size :]
+
+
+def _feed(pipe: typing.Any, input: str) -> None:
+    try:
+        pipe.write(input.encode("utf-8"))
+    except BrokenPipeError:
+        pass
+    finally:
+        pipe.close()
+
+
+def _offset(stream: typing.Any) -> typing.Optional[int]:
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _size(stream: typing.Any, output: typing.Optional[str], offset: typing.Any) -> int:
+    # captured output is measured directly, files by how far they moved
+    if output is not None:
+        return len(output.encode("utf-8"))
+    end = _offset(stream)
+    if offset is None or end is None:
+        return 0
+    return end - offset
+
+
 def query_yes_no(question: str, default: str = "yes") -> bool:
     valid = {"yes": True, "y": True, "no": False, "n": False}
     if default is None:
@@ -52,3 +239,49 @@ def query_yes_no(question: str, default: str = "yes") -> bool:
             return valid[choice]
         else:
             print(f'invalid voice "{choice}" from {[x for x in valid.keys()]}')
+
+
+def print_table(
+    headers: list[str],
+    rows: typing.Sequence[typing.Sequence],
+    file: typing.Optional[typing.TextIO] = None,
+) -> None:
+    cells = [headers] + [[str(x) for x in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    cells.insert(1, ["-" * x for x in widths])
+    for row in cells:
+        line = "  ".join(x.ljust(widths[i]) for i, x in enumerate(row))
+        print(line.rstrip(), file=file)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_fingerprint(paths: typing.Iterable[str]) -> str:
+    # hash of path, size and mtime, missing paths count too
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        except OSError:
+            digest.update(f"{path}:missing\n".encode())
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, data: str) -> None:
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,120 @@
+import logging
+import os
+import time
+import typing
+
+import inotify
+
+logger = logging.getLogger(__name__)
+
+WATCH_MASK = inotify.DIR_CHANGES | inotify.SELF_CHANGES | inotify.IN_ONLYDIR
+
+# paths changed since the last call, None when everything must be rechecked
+OnChange = typing.Callable[[typing.Optional[set[str]]], None]
+
+
+class Watcher(object):
+    # report paths changing in any of dirs, once a burst of events settles
+    def __init__(
+        self,
+        dirs: list[str],
+        on_change: OnChange,
+        debounce: float = 1.0,
+        retry: float = 5.0,
+    ) -> None:
+        self.dirs = dirs
+        self.on_change = on_change
+        self.debounce = debounce
+        self.retry = retry
+        self.inotify = inotify.Inotify()
+        self.watches: dict[int, tuple[str, tuple[int, int]]] = {}
+        self.missing = list(dirs)
+
+    def run(self) -> None:
+        dirty: set[str] = set()
+        full = True
+        first_event = last_event = 0.0
+        next_check = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_check:
+                    # remounts replace the dir without any event on the old one
+                    full = self._check() or full
+                    next_check = now + self.retry
+                if full or dirty:
+                    # flush once quiet, or after a long enough burst
+                    settle = last_event + self.debounce
+                    deadline = min(settle, first_event + self.debounce * 10)
+                    if now >= deadline:
+                        self.on_change(None if full else dirty)
+                        dirty, full = set(), False
+                        first_event = last_event = 0.0
+                        continue
+                    timeout = min(deadline, next_check) - now
+                else:
+                    timeout = next_check - now
+
+                for event in self.inotify.read(max(timeout, 0)):
+                    last_event = time.monotonic()
+                    first_event = first_event or last_event
+                    if event.mask & inotify.IN_Q_OVERFLOW:
+                        logger.warning("inotify queue overflowed, rechecking all")
+                        full = True
+                    elif event.mask & inotify.GONE:
+                        if event.wd in self.watches:
+                            path, _ = self.watches.pop(event.wd)
+                            logger.warning('lost watch on "%s"', path)
+                            self.missing.append(path)
+                            next_check = 0.0
+                    elif event.wd in self.watches and event.name:
+                        path, _ = self.watches[event.wd]
+                        dirty.add(os.path.join(path, event.name))
+        finally:
+            self.inotify.close()
+
+    def watch(self, dirs: typing.Iterable[str], replace: bool = False) -> None:
+        # watch dirs too, or only dirs when replacing, missing ones once they
+        # appear
+        wanted = set(dirs)
+        if replace:
+            for wd, (path, _) in list(self.watches.items()):
+                if path not in wanted:
+                    self.inotify.remove(wd)
+                    del self.watches[wd]
+            self.missing = [x for x in self.missing if x in wanted]
+        known = {x for x, _ in self.watches.values()}.union(self.missing)
+        self.missing.extend(sorted(wanted - known))
+        self._check()
+
+    def _check(self) -> bool:
+        # re-add watches on dirs which went away or were remounted
+        for wd, (path, watched) in list(self.watches.items()):
+            if _identity(path) != watched:
+                logger.warning('"%s" was replaced, watching it again', path)
+                self.inotify.remove(wd)
+                del self.watches[wd]
+                self.missing.append(path)
+        added = False
+        for path in list(self.missing):
+            identity = _identity(path)
+            if identity is None:
+                continue
+            try:
+                wd = self.inotify.add(path, WATCH_MASK)
+            except OSError as e:
+                logger.debug('cannot watch "%s": %s', path, e)
+                continue
+            self.watches[wd] = (path, identity)
+            self.missing.remove(path)
+            logger.debug('watching "%s"', path)
+            added = True
+        return added
+
+
+def _identity(path: str) -> typing.Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino